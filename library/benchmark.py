@@ -0,0 +1,488 @@
+"""
+Synthetic data generator and benchmark suite for the Library Management System.
+
+It generates deterministic libraries, items, members and borrowings at configurable scales, times the core
+operations of LibraryManagementSystem on them and emits the results as JSON so that runs can be compared.
+
+Usage:
+    python -m library.benchmark --scales 1000 10000 100000 --output bench.json
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from library.codec import decode_lines, encode_records
+from library.dedup import DuplicateFinder
+from library.integrity import IntegrityChecker
+from library.library import Article, Book, DigitalMedia, Library, LibraryManagementSystem, Member
+from library.render import render_lines
+
+ITEM_TYPES = ["Book", "Article", "Digital Media"]
+WORDS = [
+    "history", "science", "garden", "river", "night", "modern", "ancient", "world", "journey", "theory",
+    "python", "ocean", "empire", "music", "light", "shadow", "city", "machine", "silent", "winter",
+]  # fmt: skip
+MEDIA_FORMATS = ["DVD", "CD", "MP3", "MP4", "Blu-ray"]
+DEFAULT_SCALES = [1000, 10000, 100000]
+DEFAULT_SEED = 42
+
+
+def scale_counts(scale):
+    """
+    Returns the number of libraries, items, members and borrowings generated for a scale.
+    The scale is the number of items; the other collections are derived from it.
+    """
+    return {
+        "libraries": max(1, scale // 1000),
+        "items": scale,
+        "members": max(1, scale // 10),
+        "borrowings": scale,
+    }
+
+
+def generate_system(scale, data_dir, seed=DEFAULT_SEED):
+    """
+    Generates a deterministic data set for the given scale and saves it into the data directory.
+    The same scale and seed always produce the same files. Returns the populated system.
+    """
+    rng = random.Random(f"{seed}-{scale}")
+    counts = scale_counts(scale)
+    system = LibraryManagementSystem(data_dir=data_dir)
+    system.create_empty()
+
+    for number in range(1, counts["libraries"] + 1):
+        # Library IDs 00, 01 and 02 collide with the library menu options.
+        system.libraries.append(Library(str(number + 100), f"Library {number}"))
+
+    for number in range(1, counts["items"] + 1):
+        item_id = str(number)
+        library_id = system.libraries[rng.randrange(counts["libraries"])].library_id
+        item_type = rng.choice(ITEM_TYPES)
+        name = " ".join(rng.choice(WORDS) for _ in range(3)).title()
+        if item_type == "Book":
+            item = Book(item_id, library_id, name, f"Author {rng.randrange(counts['members'])}")
+        elif item_type == "Article":
+            item = Article(item_id, library_id, name, f"Journal {rng.randrange(100)}")
+        else:
+            item = DigitalMedia(item_id, library_id, name, rng.choice(MEDIA_FORMATS))
+        system.items.append(item)
+
+    for number in range(1, counts["members"] + 1):
+        system.members.append(Member(str(number), f"First{number}", f"Last{number}", f"member{number}@example.com"))
+
+    start = datetime.date(2020, 1, 1)
+    for number in range(1, counts["borrowings"] + 1):
+        borrow_date = start + datetime.timedelta(days=rng.randrange(1000))
+        # Roughly one in five borrowings are still open.
+        if rng.random() < 0.2:
+            return_date = None
+        else:
+            return_date = borrow_date + datetime.timedelta(days=rng.randrange(1, 30))
+        system.borrowings.append(
+            {
+                "borrowing_id": str(number),
+                "item_id": str(rng.randrange(1, counts["items"] + 1)),
+                "member_id": str(rng.randrange(1, counts["members"] + 1)),
+                "borrow_date": borrow_date,
+                "return_date": return_date,
+            }
+        )
+
+    system.index_items()
+    os.makedirs(data_dir, exist_ok=True)
+    system.save_data(force=True)
+    return system
+
+
+def loaded_system(data_dir):
+    system = LibraryManagementSystem(data_dir=data_dir)
+    system.load_data()
+    return system
+
+
+def scenario_load_data(data_dir, scale):
+    return lambda: loaded_system(data_dir)
+
+
+def scenario_member_login(data_dir, scale):
+    # What a member logging in pays: only the members are loaded.
+    return lambda: LibraryManagementSystem(data_dir=data_dir).find_member("1")
+
+
+def scenario_load_data_parallel(data_dir, scale):
+    def load():
+        system = LibraryManagementSystem(data_dir=data_dir)
+        system.load_data(parallel=True)
+        return system
+
+    return load
+
+
+def scenario_save_data(data_dir, scale):
+    system = loaded_system(data_dir)
+    # Forced so that every collection is written, as an unchanged system skips saving.
+    return lambda: system.save_data(force=True)
+
+
+def scenario_find_library(data_dir, scale):
+    system = loaded_system(data_dir)
+    # The last record is the worst case for a linear scan.
+    library_id = system.libraries[-1].library_id
+    return lambda: system.find_library(library_id)
+
+
+def scenario_find_item(data_dir, scale):
+    system = loaded_system(data_dir)
+    item_id = system.items[-1].item_id
+    return lambda: system.find_item(item_id)
+
+
+def scenario_find_member(data_dir, scale):
+    system = loaded_system(data_dir)
+    member_id = system.members[-1].member_id
+    return lambda: system.find_member(member_id)
+
+
+def scenario_find_borrowing_transaction(data_dir, scale):
+    system = loaded_system(data_dir)
+    borrowing_id = system.borrowings[-1]["borrowing_id"]
+    return lambda: system.find_borrowing_transaction(borrowing_id)
+
+
+def scenario_catalogue_listing(data_dir, scale):
+    system = loaded_system(data_dir)
+    library_id = system.libraries[0].library_id
+
+    def listing():
+        # What the books menu does to display the books of a library when the listing is not cached: the books are
+        # queried from the catalogue (on the library index) and rendered.
+        books = system.catalogue.where(library_id=library_id, item_type="Book").all()
+        return render_lines(books, "There are no items to display")
+
+    return listing
+
+
+def scenario_member_borrowings(data_dir, scale):
+    system = loaded_system(data_dir)
+    # Planned on the member index instead of scanning the borrowings.
+    return lambda: system.ledger.where(member_id="1").all()
+
+
+def scenario_cached_listing(data_dir, scale):
+    system = loaded_system(data_dir)
+    library_id = system.libraries[0].library_id
+    # The first render fills the cache; showing the unchanged listing again is what is timed.
+    system.render_items(library_id, "Book")
+    return lambda: system.render_items(library_id, "Book")
+
+
+def item_rows(data_dir):
+    system = loaded_system(data_dir)
+    return [
+        [
+            item.item_id,
+            item.library_id,
+            item.item_type,
+            item.name,
+            item.book_author,
+            item.article_journal,
+            item.media_format,
+        ]
+        for item in system.items
+    ]
+
+
+def scenario_codec_encode(data_dir, scale):
+    rows = item_rows(data_dir)
+    return lambda: list(encode_records(rows))
+
+
+def scenario_naive_join(data_dir, scale):
+    # The f-string join the savers used before the codec, for comparison.
+    rows = item_rows(data_dir)
+    return lambda: [f"{row[0]},{row[1]},{row[2]},{row[3]},{row[4]},{row[5]},{row[6]}\n" for row in rows]
+
+
+def scenario_codec_decode(data_dir, scale):
+    # encode_records yields batches of lines; the loaders decode the lines of a file.
+    lines = "".join(encode_records(item_rows(data_dir))).splitlines(keepends=True)
+    return lambda: list(decode_lines(lines))
+
+
+def scenario_naive_split(data_dir, scale):
+    # The split the loaders used before the codec, for comparison.
+    lines = [f"{row[0]},{row[1]},{row[2]},{row[3]},{row[4]},{row[5]},{row[6]}\n" for row in item_rows(data_dir)]
+    return lambda: [line.strip().split(",") for line in lines]
+
+
+def scenario_add_item(data_dir, scale):
+    system = loaded_system(data_dir)
+    library_id = system.libraries[0].library_id
+    counter = iter(range(scale + 1, sys.maxsize))
+    return lambda: system.add_item(str(next(counter)), library_id, "Book", "Benchmark Book", book_author="Bench")
+
+
+def available_items(system):
+    # The items which can be borrowed: items on loan are refused, so timing them would time the refusal.
+    return iter([item.item_id for item in system.items if not system.loans.is_borrowed(item.item_id)])
+
+
+def scenario_borrow_item(data_dir, scale):
+    system = loaded_system(data_dir)
+    member_id = system.members[0].member_id
+    item_ids = available_items(system)
+    return lambda: system.borrow_item(next(item_ids), member_id)
+
+
+def scenario_borrow_items(data_dir, scale):
+    system = loaded_system(data_dir)
+    member_id = system.members[-1].member_id
+    item_ids = available_items(system)
+    # A cart of ten items per checkout.
+    return lambda: system.borrow_items(list(itertools.islice(item_ids, 10)), member_id)
+
+
+def scenario_return_item(data_dir, scale):
+    system = loaded_system(data_dir)
+    open_borrowings = iter(
+        [borrowing["borrowing_id"] for borrowing in system.borrowings if borrowing["return_date"] is None]
+    )
+    return lambda: system.return_item(next(open_borrowings, "0"))
+
+
+def scenario_snapshot_scan(data_dir, scale):
+    system = loaded_system(data_dir)
+    # A member of its own so that the loans it leaves behind do not affect the other scenarios.
+    member_id = system.members[len(system.members) // 2].member_id
+    counter = iter(range(1, sys.maxsize))
+
+    def scan_under_load():
+        # Two full scans of a snapshot while another thread borrows and returns items; both scans should agree.
+        stopping = threading.Event()
+
+        def traffic():
+            while not stopping.is_set():
+                system.borrow_item(str(next(counter) % scale + 1), member_id)
+                borrowing = system.ledger.where(member_id=member_id, return_date=None).first()
+                if borrowing is not None:
+                    system.return_item(borrowing["borrowing_id"])
+
+        writer = threading.Thread(target=traffic)
+        writer.start()
+        try:
+            with system.snapshot() as snapshot:
+                first = [(borrowing["borrowing_id"], borrowing["return_date"]) for borrowing in snapshot.borrowings]
+                second = [(borrowing["borrowing_id"], borrowing["return_date"]) for borrowing in snapshot.borrowings]
+        finally:
+            stopping.set()
+            writer.join()
+        if first != second:
+            raise AssertionError("The snapshot changed while it was being scanned")
+
+    return scan_under_load
+
+
+def scenario_integrity_check(data_dir, scale):
+    # Checks every file without repairing anything.
+    return lambda: IntegrityChecker(data_dir).run()
+
+
+def scenario_dedup(data_dir, scale):
+    # Clusters the duplicates of the whole catalogue, e.g. at --scales 1000000 --scenarios dedup.
+    items = loaded_system(data_dir).items
+    return lambda: DuplicateFinder().find(items)
+
+
+def scenario_delete_library(data_dir, scale):
+    system = loaded_system(data_dir)
+    library = system.libraries[0]
+    items = list(system.library_items[library.library_id].values())
+
+    def restore():
+        # Puts the deleted library and its items back, so that every run deletes a library of the same size.
+        if system.find_library(library.library_id):
+            return
+        system.libraries.append(library)
+        system.items.extend(items)
+        for item in items:
+            system.add_item_to_index(item)
+        system.mark_changed("libraries")
+        system.mark_changed("items")
+        system.save_data()
+
+    def delete():
+        return system.delete_library(library.library_id)
+
+    delete.prepare = restore
+    return delete
+
+
+# Scenarios run in this order; mutating scenarios come last since they modify the generated files.
+SCENARIOS = {
+    "load_data": scenario_load_data,
+    "load_data_parallel": scenario_load_data_parallel,
+    "member_login": scenario_member_login,
+    "save_data": scenario_save_data,
+    "find_library": scenario_find_library,
+    "find_item": scenario_find_item,
+    "find_member": scenario_find_member,
+    "find_borrowing_transaction": scenario_find_borrowing_transaction,
+    "catalogue_listing": scenario_catalogue_listing,
+    "cached_listing": scenario_cached_listing,
+    "member_borrowings": scenario_member_borrowings,
+    "codec_encode": scenario_codec_encode,
+    "naive_join": scenario_naive_join,
+    "codec_decode": scenario_codec_decode,
+    "naive_split": scenario_naive_split,
+    "integrity_check": scenario_integrity_check,
+    "dedup": scenario_dedup,
+    "add_item": scenario_add_item,
+    "borrow_item": scenario_borrow_item,
+    "borrow_items": scenario_borrow_items,
+    "return_item": scenario_return_item,
+    "snapshot_scan": scenario_snapshot_scan,
+    "delete_library": scenario_delete_library,
+}
+
+
+def time_scenario(setup, data_dir, scale, repeat):
+    """
+    Runs a scenario `repeat` times and returns the timings in seconds.
+    A scenario setup prepares its data (untimed) and returns the operation to time. If the operation has a `prepare`
+    attribute, it is called (untimed) before each run, e.g. to undo what the previous run changed.
+    """
+    operation = setup(data_dir, scale)
+    prepare = getattr(operation, "prepare", None)
+    timings = []
+    for _ in range(repeat):
+        if prepare is not None:
+            prepare()
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_benchmarks(scales, scenarios=None, repeat=5, seed=DEFAULT_SEED, work_dir=None, progress=None):
+    """
+    Generates a data set for every scale and times each scenario on it.
+    Returns a JSON serialisable dictionary of the results.
+    """
+    scenarios = scenarios or list(SCENARIOS)
+    results = []
+    base_dir = tempfile.mkdtemp(prefix="lms-bench-", dir=work_dir)
+    try:
+        for scale in scales:
+            data_dir = os.path.join(base_dir, str(scale))
+            start = time.perf_counter()
+            generate_system(scale, data_dir, seed)
+            if progress:
+                progress(f"Generated scale {scale} in {time.perf_counter() - start:.2f}s")
+            for name in scenarios:
+                timings = time_scenario(SCENARIOS[name], data_dir, scale, repeat)
+                results.append(
+                    {
+                        "scenario": name,
+                        "scale": scale,
+                        "repeat": repeat,
+                        "timings": timings,
+                        "min": min(timings),
+                        "median": statistics.median(timings),
+                        "mean": statistics.fmean(timings),
+                    }
+                )
+                if progress:
+                    progress(f"  {name:<28} scale={scale:<10} median={statistics.median(timings):.6f}s")
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seed": seed,
+            "scales": {str(scale): scale_counts(scale) for scale in scales},
+        },
+        "results": results,
+    }
+
+
+def complexity_table(report):
+    """
+    Tabulates the median timing of each scenario across scales.
+    The growth column is the log-log slope between the smallest and largest scale: ~0 is constant, ~1 is linear.
+    """
+    scales = sorted({result["scale"] for result in report["results"]})
+    medians = {}
+    for result in report["results"]:
+        medians.setdefault(result["scenario"], {})[result["scale"]] = result["median"]
+
+    header = f"{'Scenario':<28}" + "".join(f"{scale:>14}" for scale in scales) + f"{'Growth':>10}"
+    lines = [header, "-" * len(header)]
+    for scenario, timings in medians.items():
+        row = f"{scenario:<28}" + "".join(f"{timings.get(scale, float('nan')):>14.6f}" for scale in scales)
+        smallest, largest = scales[0], scales[-1]
+        if largest > smallest and timings.get(smallest, 0) > 0 and timings.get(largest, 0) > 0:
+            growth = math.log(timings[largest] / timings[smallest]) / math.log(largest / smallest)
+            row += f"{growth:>10.2f}"
+        else:
+            row += f"{'-':>10}"
+        lines.append(row)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the core operations of the Library Management System.")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Number of items per data set")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), help="Scenarios to run (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions of each scenario")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the data generator")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--work-dir", help="Directory in which the data sets are generated")
+    parser.add_argument("--compare", help="A previous JSON results file to compare the medians against")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(
+        args.scales, args.scenarios, args.repeat, args.seed, args.work_dir, progress=lambda line: print(line)
+    )
+    print("")
+    print(complexity_table(report))
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            previous = json.load(file)
+        previous_medians = {(result["scenario"], result["scale"]): result["median"] for result in previous["results"]}
+        print("")
+        print(f"{'Scenario':<28}{'Scale':>10}{'Previous':>14}{'Current':>14}{'Change':>10}")
+        for result in report["results"]:
+            before = previous_medians.get((result["scenario"], result["scale"]))
+            if before:
+                change = (result["median"] - before) / before * 100
+                print(
+                    f"{result['scenario']:<28}{result['scale']:>10}{before:>14.6f}{result['median']:>14.6f}"
+                    f"{change:>9.1f}%"
+                )
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print("")
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Record codec of the data files.
+
+A data file starts with a format header line followed by one record per line. Fields are separated by commas;
+backslash, comma, '#' and line breaks inside a field are escaped with a backslash, and a missing value (None) is
+written as \\N. Records are encoded and decoded in batches: a batch without any escaped character (the vast
+majority) is joined or split as a whole, with nulls swapped through a dictionary lookup, and only the records of the
+other batches take the slower escaping paths.
+
+Files without the header are in the legacy format: fields joined with commas without escaping and None written as
+the string 'None'. They are still read, and are rewritten in the current format the next time they are saved.
+
+Usage:
+    python -m library.codec migrate --data-dir data
+"""
+
+import argparse
+import itertools
+import operator
+import os
+import re
+
+FORMAT_VERSION = 2
+FORMAT_HEADER = f"#LMS-FORMAT {FORMAT_VERSION}"
+NULL = "\\N"
+
+ESCAPES = {"\\": "\\\\", ",": "\\,", "#": "\\#", "\n": "\\n", "\r": "\\r"}
+ESCAPE_TABLE = str.maketrans(ESCAPES)
+UNESCAPES = {escaped[1]: character for character, escaped in ESCAPES.items()}
+# Looked up with map(NULLS.get, fields, fields), which swaps the nulls and keeps the other values without a Python loop.
+ENCODE_NULLS = {None: NULL}
+DECODE_NULLS = {NULL: None}
+
+# A field is a run of unescaped characters and escape sequences, ended by a comma or the end of the line.
+FIELD_PATTERN = re.compile(r"((?:[^\\,]|\\.)*)(,|$)", re.DOTALL)
+ESCAPE_PATTERN = re.compile(r"\\(.)", re.DOTALL)
+
+
+class CodecError(ValueError):
+    """
+    Raised when a line is not a valid record.
+    """
+
+
+def encode_field(value):
+    if value is None:
+        return NULL
+    return value.translate(ESCAPE_TABLE)
+
+
+def encode_record(fields):
+    """
+    Encodes the fields (strings or None) of a record into a line, including the line break.
+    """
+    line = ",".join([NULL if value is None else value for value in fields])
+    # The joined line can be used as it is if the only commas are separators, the only backslashes come from
+    # nulls, and nothing else needs escaping.
+    if (
+        line.count(",") == len(fields) - 1
+        and line.count("\\") == fields.count(None)
+        and "#" not in line
+        and "\n" not in line
+        and "\r" not in line
+    ):
+        return line + "\n"
+    return ",".join([encode_field(value) for value in fields]) + "\n"
+
+
+def unescape(match):
+    character = match.group(1)
+    if character not in UNESCAPES:
+        raise CodecError(f"Invalid escape sequence: \\{character}")
+    return UNESCAPES[character]
+
+
+def decode_record(line, count=None):
+    """
+    Decodes a line into the list of its fields. Raises a CodecError if it does not have `count` fields.
+    """
+    if line.endswith("\n"):
+        line = line[:-1]
+    if "\\" not in line:
+        # Nothing is escaped and there are no nulls.
+        fields = line.split(",")
+    elif line.count("\\") == line.count(NULL):
+        # The only backslashes are nulls.
+        fields = [None if field == NULL else field for field in line.split(",")]
+    elif "\\," not in line:
+        # No comma is escaped, so the separators are all the commas.
+        fields = line.split(",")
+        for index, field in enumerate(fields):
+            if "\\" in field:
+                fields[index] = None if field == NULL else ESCAPE_PATTERN.sub(unescape, field)
+    else:
+        fields = []
+        for field, separator in FIELD_PATTERN.findall(line):
+            if field == NULL:
+                fields.append(None)
+            else:
+                fields.append(ESCAPE_PATTERN.sub(unescape, field))
+            if separator == "":
+                break
+    if count is not None and len(fields) != count:
+        raise CodecError(f"Expected {count} fields but found {len(fields)}: {line!r}")
+    return fields
+
+
+def decode_lines(lines, count=None, batch_size=1024):
+    """
+    Yields the fields of each line, like decode_record, for lines as read from a file (each ending with its line
+    break). The lines are decoded in batches: a batch where every line has the same number of fields and the only
+    backslashes are nulls is split as a single text, and its records are yielded as tuples.
+    """
+    lines = iter(lines)
+    while True:
+        batch = list(itertools.islice(lines, batch_size))
+        if not batch:
+            return
+        text = "".join(batch)
+        if text.endswith("\n"):
+            text = text[:-1]
+        # All the records of a file have the same number of fields, that of the first one unless given.
+        fields_count = count if count is not None else batch[0].count(",") + 1
+        fields = text.replace("\n", ",").split(",")
+        # With the expected number of commas, the expected number of fields means one line break per line.
+        if (
+            len(fields) == len(batch) * fields_count
+            and text.count(",") == len(batch) * (fields_count - 1)
+            and ("\\" not in text or text.count("\\") == text.count(NULL))
+        ):
+            # The records are rebuilt from the columns, which only need their nulls swapped if they have any.
+            columns = [fields[index::fields_count] for index in range(fields_count)]
+            if "\\" in text:
+                columns = [
+                    list(map(DECODE_NULLS.get, column, column)) if NULL in column else column for column in columns
+                ]
+            yield from zip(*columns)
+        else:
+            for line in batch:
+                yield decode_record(line, count)
+
+
+def encode_batch(batch):
+    """
+    Encodes a list of records into text. The records are joined first and the text is used as it is if it holds
+    only the expected separators, line breaks and null backslashes; otherwise each record is encoded on its own.
+    """
+    try:
+        # Records without nulls are joined as they are.
+        text = "\n".join(map(",".join, batch))
+        nulls = 0
+    except TypeError:
+        fields_count = len(batch[0])
+        if len(set(map(len, batch))) != 1:
+            return "".join([encode_record(fields) for fields in batch])
+        # The fields of all the records, with the nulls swapped, are joined by record without a Python loop.
+        fields = map(ENCODE_NULLS.get, itertools.chain.from_iterable(batch), itertools.chain.from_iterable(batch))
+        text = "\n".join(map(",".join, zip(*[fields] * fields_count)))
+        nulls = sum(map(operator.countOf, batch, itertools.repeat(None)))
+    if (
+        text.count(",") == sum(map(len, batch)) - len(batch)
+        and text.count("\n") == len(batch) - 1
+        and "#" not in text
+        and "\r" not in text
+        and ("\\" not in text or text.count("\\") == nulls)
+    ):
+        return text + "\n"
+    return "".join([encode_record(fields) for fields in batch])
+
+
+def encode_records(records, batch_size=1024):
+    """
+    Yields the encoded text of the records in batches, for writing with writelines.
+    Records are lists of fields.
+    """
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield encode_batch(batch)
+
+
+def decode_legacy_record(line, count=None):
+    """
+    Decodes a line of the legacy format, where None was written as 'None'.
+    """
+    fields = [None if value == "None" else value for value in line.strip().split(",")]
+    if count is not None and len(fields) != count:
+        raise CodecError(f"Expected {count} fields but found {len(fields)}: {line!r}")
+    return fields
+
+
+def decoder_for(first_line):
+    """
+    Returns the decoder of a file given its first line, and whether that line is a header to skip.
+    """
+    if first_line.startswith("#LMS-FORMAT "):
+        version = first_line[len("#LMS-FORMAT ") :].strip()
+        if version != str(FORMAT_VERSION):
+            raise CodecError(f"Unsupported data file format version: {version}")
+        return decode_record, True
+    return decode_legacy_record, False
+
+
+def read_records(file, count=None):
+    """
+    Yields the decoded records of an open data file in either format.
+    """
+    first_line = file.readline()
+    if not first_line:
+        return
+    decode, is_header = decoder_for(first_line)
+    if is_header:
+        yield from decode_lines(file, count)
+        return
+    yield decode(first_line, count)
+    for line in file:
+        yield decode(line, count)
+
+
+def write_header(file):
+    file.write(FORMAT_HEADER + "\n")
+
+
+def data_offset(path):
+    """
+    Returns the decoder of a data file and the byte offset at which its records start.
+    """
+    with open(path, "rb") as file:
+        first_line = file.readline()
+    decode, is_header = decoder_for(first_line.decode())
+    return decode, len(first_line) if is_header else 0
+
+
+def migrate(data_dir="data"):
+    """
+    Rewrites the data files of a directory in the current format. Returns the names of the migrated files.
+    """
+    # Imported here since the library module depends on this module.
+    from library.library import LibraryManagementSystem
+
+    legacy_files = []
+    for filename in LibraryManagementSystem.DATA_FILES.values():
+        path = os.path.join(data_dir, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path, "r") as file:
+            if not file.readline().startswith("#LMS-FORMAT "):
+                legacy_files.append(filename)
+
+    if legacy_files:
+        system = LibraryManagementSystem(data_dir=data_dir)
+        system.load_data()
+        system.save_data(force=True)
+    return legacy_files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Data file format tools of the Library Management System.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="Rewrite legacy data files in the current format")
+    migrate_parser.add_argument("--data-dir", default="data", help="Directory of the data files")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        migrated = migrate(args.data_dir)
+        if migrated:
+            print(f"Migrated {', '.join(migrated)} to format version {FORMAT_VERSION}")
+        else:
+            print("All data files are already in the current format")
+
+
+if __name__ == "__main__":
+    main()
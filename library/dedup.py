@@ -0,0 +1,293 @@
+"""
+Detection of items catalogued more than once, e.g. the same book held by several libraries under different item IDs
+with slightly different names or authors.
+
+Names, authors and journals are normalized (case, accents, punctuation, '&', leading articles). Catalogues repeat
+names, so the distinct names are matched first. Instead of comparing every pair of names, each name gets a MinHash
+signature of its character trigrams, split into bands; names sharing a band are candidates (locality sensitive
+hashing): similar names are very likely to share at least one band, dissimilar ones rarely do. Each band keeps its
+first few cluster leaders and a new name is only compared to these, so the work grows linearly with the number of
+names. The items of the same type whose names are in the same cluster are then matched by their author (books),
+journal (articles) or format (digital media), and the duplicates are merged into clusters with a union-find.
+
+Usage:
+    python -m library.dedup --data-dir data --output duplicates.csv
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+import unicodedata
+import zlib
+
+from library.export import FORMATS, open_output, write_records
+
+CLUSTER_FIELDS = [
+    "cluster_id",
+    "item_id",
+    "library_id",
+    "item_type",
+    "name",
+    "book_author",
+    "article_journal",
+    "media_format",
+]
+
+LEADING_ARTICLES = {"the", "a", "an"}
+PUNCTUATION = re.compile(r"[^\w\s]+")
+
+# 4 bands of 3 hashes: names with a trigram similarity of 0.8 share a band with a probability of about 94%, names
+# with a similarity of 0.3 about 10%.
+BANDS = 4
+ROWS = 3
+
+
+def normalize(text):
+    """
+    Normalizes a name or author for comparison: lower case without accents, punctuation and leading articles.
+    """
+    if not text:
+        return ""
+    if not text.isascii():
+        text = "".join(
+            character for character in unicodedata.normalize("NFKD", text) if not unicodedata.combining(character)
+        )
+    words = PUNCTUATION.sub(" ", text.lower().replace("&", " and ")).split()
+    if words and words[0] in LEADING_ARTICLES:
+        words = words[1:]
+    return " ".join(words)
+
+
+def trigrams(text):
+    if len(text) < 3:
+        return {text}
+    return {text[index : index + 3] for index in range(len(text) - 2)}
+
+
+def jaccard(first, second):
+    if not first and not second:
+        return 1.0
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+def secondary_field(item):
+    # The field telling apart different works with the same name.
+    if item.item_type == "Book":
+        return item.book_author
+    if item.item_type == "Article":
+        return item.article_journal
+    return item.media_format
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parents = list(range(size))
+
+    def find(self, node):
+        parents = self.parents
+        root = node
+        while parents[root] != root:
+            root = parents[root]
+        # Path compression
+        while parents[node] != root:
+            parents[node], node = root, parents[node]
+        return root
+
+    def union(self, first, second):
+        first, second = self.find(first), self.find(second)
+        if first == second:
+            return False
+        # The smaller index becomes the root so that clusters are numbered in catalogue order.
+        if second < first:
+            first, second = second, first
+        self.parents[second] = first
+        return True
+
+
+class DuplicateFinder:
+    """
+    Finds clusters of probable duplicates among a list of items.
+    """
+
+    def __init__(
+        self, name_threshold=0.7, secondary_threshold=0.5, bands=BANDS, rows=ROWS, representatives=8, seed=42
+    ):
+        # Minimum trigram similarity of the names, and word similarity of the authors/journals, of duplicates.
+        self.name_threshold = name_threshold
+        self.secondary_threshold = secondary_threshold
+        # Maximum number of names of a band, and of items of a name cluster, later ones are compared to
+        self.representatives = representatives
+        self.bands = bands
+        self.rows = rows
+        rng = random.Random(seed)
+        # Hash functions h(x) = (a * x + b) mod 2^32 with odd a, one per row of every band.
+        self.hash_functions = [(rng.randrange(1, 1 << 32, 2), rng.randrange(1 << 32)) for _ in range(bands * rows)]
+        self.candidates = 0
+        self.merges = 0
+
+    def band_keys(self, grams):
+        # The MinHash signature of the trigrams, cut into bands.
+        hashes = [zlib.crc32(gram.encode()) for gram in grams]
+        signature = [min([(a * value + b) & 0xFFFFFFFF for value in hashes]) for a, b in self.hash_functions]
+        rows = self.rows
+        return [(band, *signature[band * rows : (band + 1) * rows]) for band in range(self.bands)]
+
+    def similar_secondaries(self, first, second):
+        # A missing author/journal/format does not tell the items apart.
+        if not first or not second or first == second:
+            return True
+        return jaccard(set(first.split()), set(second.split())) >= self.secondary_threshold
+
+    def match_names(self, names, progress=None):
+        """
+        Clusters similar names. names is a list of (name, trigrams); returns the index of the leader of each name.
+
+        A name joins the first leader it is similar to, or leads a new cluster if there is none. Joining a single
+        leader keeps names from chaining into one cluster through small steps (e.g. "ancient city", "ancient river",
+        "modern river").
+        """
+        leaders = list(range(len(names)))
+        # Band key -> indexes of the leaders later names of the band are compared to
+        representatives = {}
+        for index, (name, grams) in enumerate(names):
+            buckets = [representatives.setdefault(band_key, []) for band_key in self.band_keys(grams)]
+            compared = set()
+            for others in buckets:
+                for other in others:
+                    if other not in compared:
+                        compared.add(other)
+                        self.candidates += 1
+                        if jaccard(grams, names[other][1]) >= self.name_threshold:
+                            leaders[index] = other
+                            break
+                if leaders[index] != index:
+                    break
+            else:
+                for others in buckets:
+                    if len(others) < self.representatives:
+                        others.append(index)
+            if progress:
+                progress(index + 1, len(names))
+        return leaders
+
+    def find(self, items, progress=None, progress_every=100000):
+        """
+        Returns the clusters of duplicates as lists of items (clusters of a single item are left out).
+        progress, if given, is called with a status line every progress_every items or names.
+        """
+        start = time.perf_counter()
+
+        def report(stage):
+            def step(done, total):
+                if done % progress_every == 0 or done == total:
+                    elapsed = time.perf_counter() - start
+                    progress(
+                        f"{stage} {done}/{total} in {elapsed:.1f}s, {self.candidates} candidate pairs, "
+                        f"{self.merges} merges"
+                    )
+
+            return step if progress else None
+
+        # Catalogues repeat names: the names are compared once, and the items through the clusters of their names.
+        count = len(items)
+        # Normalized name -> its index in names
+        name_indexes = {}
+        names = []
+        # Item index -> (item type, name index, normalized secondary field); None for items without a name
+        profiles = [None] * count
+        step = report("Normalized items")
+        for index, item in enumerate(items):
+            name = normalize(item.name)
+            if name:
+                if name not in name_indexes:
+                    name_indexes[name] = len(names)
+                    names.append((name, trigrams(name)))
+                profiles[index] = item.item_type, name_indexes[name], normalize(secondary_field(item))
+            if step:
+                step(index + 1, count)
+
+        leaders = self.match_names(names, report("Compared names"))
+
+        clusters = UnionFind(count)
+        # (Item type, name leader) -> ({secondary field: first item index}, indexes of the items compared to)
+        groups = {}
+        step = report("Grouped items")
+        for index, profile in enumerate(profiles):
+            if profile is not None:
+                item_type, name_index, secondary = profile
+                firsts, others = groups.setdefault((item_type, leaders[name_index]), ({}, []))
+                if secondary in firsts:
+                    # Same name cluster and the same author/journal/format
+                    if clusters.union(index, firsts[secondary]):
+                        self.merges += 1
+                else:
+                    firsts[secondary] = index
+                    for other in others:
+                        self.candidates += 1
+                        if self.similar_secondaries(secondary, profiles[other][2]):
+                            if clusters.union(index, other):
+                                self.merges += 1
+                            break
+                    else:
+                        if len(others) < self.representatives:
+                            others.append(index)
+            if step:
+                step(index + 1, count)
+
+        groups = {}
+        for index in range(count):
+            groups.setdefault(clusters.find(index), []).append(items[index])
+        return [group for group in groups.values() if len(group) > 1]
+
+
+def cross_library(cluster):
+    return len({item.library_id for item in cluster}) > 1
+
+
+def cluster_records(clusters):
+    for cluster_id, cluster in enumerate(clusters, 1):
+        for item in cluster:
+            record = {"cluster_id": cluster_id}
+            record.update({field: getattr(item, field) for field in CLUSTER_FIELDS[1:]})
+            yield record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find items catalogued more than once across the libraries.")
+    parser.add_argument("--data-dir", default="data", help="Directory of the data files")
+    parser.add_argument("--output", help="Output file of the clusters (default: standard output)")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="Output format")
+    parser.add_argument("--within-library", action="store_true", help="Also report duplicates within one library")
+    parser.add_argument("--threshold", type=float, default=0.7, help="Minimum name similarity (0 to 1)")
+    args = parser.parse_args(argv)
+
+    # Imported here since the library module uses the export module this module depends on.
+    from library.library import LibraryManagementSystem
+
+    def progress(line):
+        print(line, file=sys.stderr, flush=True)
+
+    start = time.perf_counter()
+    items = LibraryManagementSystem(data_dir=args.data_dir).items
+    progress(f"Loaded {len(items)} items in {time.perf_counter() - start:.1f}s")
+    finder = DuplicateFinder(name_threshold=args.threshold)
+    clusters = finder.find(items, progress)
+    if not args.within_library:
+        clusters = [cluster for cluster in clusters if cross_library(cluster)]
+
+    if args.output is None:
+        write_records(cluster_records(clusters), CLUSTER_FIELDS, sys.stdout, args.format)
+    else:
+        with open_output(args.output) as file:
+            write_records(cluster_records(clusters), CLUSTER_FIELDS, file, args.format)
+    progress(
+        f"Found {len(clusters)} clusters of {sum(len(cluster) for cluster in clusters)} items in "
+        f"{time.perf_counter() - start:.1f}s ({finder.candidates} candidate pairs compared)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Change-data-capture events published by the mutating methods of LibraryManagementSystem.
+
+Every change (add/edit/delete of libraries, items and members, borrowing and returning items) is published as a
+ChangeEvent with a monotonically increasing sequence number. In-process subscribers receive the events directly.
+A FileEventFeed appends them to a JSON Lines file that other processes can follow incrementally.
+
+Usage:
+    python main.py --events-file data/events.jsonl
+    python -m library.events data/events.jsonl --after 0 --follow
+"""
+
+import argparse
+import datetime
+import json
+import os
+import time
+
+
+class ChangeEvent:
+    """
+    A change made to one record of a collection.
+    The operation is the name of the method that made the change, e.g. 'add_item' or 'return_item'.
+    The data holds the fields of the record after the change, or None when the record was deleted.
+    """
+
+    def __init__(self, sequence, operation, collection, key, data=None, timestamp=None):
+        self.sequence = sequence
+        self.operation = operation
+        self.collection = collection
+        self.key = key
+        self.data = data
+        self.timestamp = timestamp or datetime.datetime.now().isoformat(timespec="seconds")
+
+    def __str__(self):
+        return f"#{self.sequence} {self.timestamp} {self.operation} {self.collection} {self.key}"
+
+    def to_dict(self):
+        return {
+            "sequence": self.sequence,
+            "operation": self.operation,
+            "collection": self.collection,
+            "key": self.key,
+            "data": self.data,
+            "timestamp": self.timestamp,
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(
+            values["sequence"],
+            values["operation"],
+            values["collection"],
+            values["key"],
+            values.get("data"),
+            values.get("timestamp"),
+        )
+
+
+class EventBus:
+    """
+    Publishes change events to subscribers. A subscriber is a callable receiving a ChangeEvent.
+    """
+
+    def __init__(self, sequence=0):
+        # The sequence number of the last published event.
+        self.sequence = sequence
+        self.subscribers = []
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
+
+    def publish(self, operation, collection, key, data=None):
+        self.sequence += 1
+        # Nothing is built when no one is listening.
+        if not self.subscribers:
+            return None
+        event = ChangeEvent(self.sequence, operation, collection, key, data)
+        for subscriber in self.subscribers:
+            subscriber(event)
+        return event
+
+
+class FileEventFeed:
+    """
+    A subscriber appending events to a JSON Lines file, one event per line.
+    When attached to a bus, the bus continues numbering from the last sequence number in the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def last_sequence(self):
+        sequence = 0
+        if os.path.exists(self.path):
+            for event in read_events(self.path):
+                sequence = event.sequence
+        return sequence
+
+    def attach(self, bus):
+        bus.sequence = max(bus.sequence, self.last_sequence())
+        self.file = open(self.path, "a")
+        bus.subscribe(self)
+        return self
+
+    def __call__(self, event):
+        self.file.write(json.dumps(event.to_dict()) + "\n")
+        # Flushed so that followers see the event straight away.
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_events(path, after=0, position=0):
+    """
+    Yields the events of a feed file with a sequence number greater than `after`, starting at a byte position.
+    A partially written last line is left for the next read.
+    """
+    for event, _ in read_events_from(path, after, position):
+        if event is not None:
+            yield event
+
+
+def read_events_from(path, after=0, position=0):
+    """
+    Same as read_events but yields an (event, position) pair for every complete line, where position is the byte
+    offset after the line. The event is None for the lines of events up to `after`, so that a reader skipping them
+    still knows where to resume.
+    """
+    with open(path, "rb") as file:
+        file.seek(position)
+        while True:
+            line = file.readline()
+            if not line.endswith(b"\n"):
+                break
+            position = file.tell()
+            event = ChangeEvent.from_dict(json.loads(line))
+            yield (event if event.sequence > after else None), position
+
+
+def follow(path, after=0, poll_interval=0.5):
+    """
+    Yields the events of a feed file as they are appended, like 'tail -f'. Only new bytes are read on each poll.
+    """
+    position = 0
+    while True:
+        if os.path.exists(path):
+            for event, position in read_events_from(path, after, position):
+                if event is not None:
+                    after = event.sequence
+                    yield event
+        time.sleep(poll_interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read the change events of a Library Management System feed file.")
+    parser.add_argument("path", help="The events file")
+    parser.add_argument("--after", type=int, default=0, help="Only show events after this sequence number")
+    parser.add_argument("--follow", action="store_true", help="Keep waiting for new events")
+    parser.add_argument("--json", action="store_true", help="Print the events as JSON")
+    args = parser.parse_args(argv)
+
+    events = follow(args.path, args.after) if args.follow else read_events(args.path, args.after)
+    try:
+        for event in events:
+            print(json.dumps(event.to_dict()) if args.json else event, flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Streaming export of the catalogue (items) and ledger (borrowings) to CSV or JSON Lines, optionally gzip compressed.
+
+Records are produced by generators and written one at a time with the filters applied as they stream, so an
+export does not build any intermediate list regardless of the size of the data.
+
+Usage:
+    python -m library.export items --format csv --output items.csv --library 1 --type Book
+    python -m library.export borrowings --format jsonl --output borrowings.jsonl.gz --from 2023-01-01
+"""
+
+import argparse
+import csv
+import datetime
+import gzip
+import json
+import sys
+
+ITEM_FIELDS = ["item_id", "library_id", "item_type", "name", "book_author", "article_journal", "media_format"]
+BORROWING_FIELDS = ["borrowing_id", "item_id", "library_id", "item_type", "member_id", "borrow_date", "return_date"]
+FORMATS = ["csv", "jsonl"]
+
+
+def iter_items(system, library_id=None, item_type=None):
+    """
+    Yields the items of the system as dictionaries, optionally filtered by library and item type.
+    """
+    items = system.catalogue
+    if library_id is not None:
+        items = items.where(library_id=library_id)
+    if item_type is not None:
+        items = items.where(item_type=item_type)
+    for item in items:
+        yield {field: getattr(item, field) for field in ITEM_FIELDS}
+
+
+def iter_borrowings(system, library_id=None, item_type=None, start=None, end=None):
+    """
+    Yields the borrowings of the system as dictionaries, optionally filtered by the library and type of the
+    borrowed item and by an inclusive range of borrowing dates.
+    Borrowings of items which no longer exist have no library or type and are skipped by those filters.
+    With a date range the borrowings are taken from the borrowing date index, so they come in date order.
+    """
+    borrowings = system.ledger
+    if start is not None or end is not None:
+        borrowings = borrowings.between("borrow_date", start, end)
+    for borrowing in borrowings:
+        item = system.item_index.get(borrowing["item_id"])
+        record_library_id = item.library_id if item is not None else None
+        record_item_type = item.item_type if item is not None else None
+        if library_id is not None and record_library_id != library_id:
+            continue
+        if item_type is not None and record_item_type != item_type:
+            continue
+        yield {
+            "borrowing_id": borrowing["borrowing_id"],
+            "item_id": borrowing["item_id"],
+            "library_id": record_library_id,
+            "item_type": record_item_type,
+            "member_id": borrowing["member_id"],
+            "borrow_date": borrowing["borrow_date"].isoformat(),
+            "return_date": borrowing["return_date"].isoformat() if borrowing["return_date"] is not None else None,
+        }
+
+
+def open_output(path, compress=None):
+    """
+    Opens the output file for writing text. Paths ending in '.gz' are gzip compressed unless compress says otherwise.
+    """
+    if compress is None:
+        compress = path.endswith(".gz")
+    if compress:
+        return gzip.open(path, "wt", newline="", encoding="utf-8")
+    return open(path, "w", newline="", encoding="utf-8")
+
+
+def write_records(records, fields, file, fmt):
+    """
+    Writes records to an open file in the given format. Returns the number of records written.
+    In CSV a missing value is an empty field; in JSON Lines it is null.
+    """
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(file)
+        writer.writerow(fields)
+        for record in records:
+            writer.writerow(["" if record[field] is None else record[field] for field in fields])
+            count += 1
+    elif fmt == "jsonl":
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+            count += 1
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return count
+
+
+def iter_records(system, kind, library_id=None, item_type=None, start=None, end=None):
+    """
+    Returns the record generator and the fields of an export of items or borrowings.
+    """
+    if kind == "items":
+        return iter_items(system, library_id, item_type), ITEM_FIELDS
+    elif kind == "borrowings":
+        return iter_borrowings(system, library_id, item_type, start, end), BORROWING_FIELDS
+    raise ValueError(f"Unknown export: {kind}")
+
+
+def export(system, kind, path, fmt="csv", compress=None, library_id=None, item_type=None, start=None, end=None):
+    """
+    Exports the items or borrowings of the system to a file. Returns the number of records written.
+    """
+    records, fields = iter_records(system, kind, library_id, item_type, start, end)
+    with open_output(path, compress) as file:
+        return write_records(records, fields, file, fmt)
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the items or borrowings of the Library Management System.")
+    parser.add_argument("kind", choices=["items", "borrowings"], help="What to export")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="Output format")
+    parser.add_argument("--output", help="Output file (default: standard output). A '.gz' suffix compresses it")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output even without a '.gz' suffix")
+    parser.add_argument("--library", help="Only export records of this library ID")
+    parser.add_argument("--type", choices=["Book", "Article", "Digital Media"], help="Only export this item type")
+    parser.add_argument("--from", dest="start", type=parse_date, help="Earliest borrowing date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", type=parse_date, help="Latest borrowing date (YYYY-MM-DD)")
+    parser.add_argument("--data-dir", default="data", help="Directory of the data files")
+    args = parser.parse_args(argv)
+
+    # Imported here since the library module uses this module for the export menu.
+    from library.library import LibraryManagementSystem
+
+    system = LibraryManagementSystem(data_dir=args.data_dir)
+    system.load_data()
+
+    if args.output is None:
+        records, fields = iter_records(system, args.kind, args.library, args.type, args.start, args.end)
+        write_records(records, fields, sys.stdout, args.format)
+        return
+
+    compress = True if args.gzip else None
+    count = export(
+        system, args.kind, args.output, args.format, compress, args.library, args.type, args.start, args.end
+    )
+    print(f"Exported {count} {args.kind} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
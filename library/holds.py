@@ -0,0 +1,157 @@
+"""
+Reservations (holds) on the items of the Library Management System.
+
+A member places a hold on an item to be next in line for it. Each item has a first-in first-out queue of waiting
+holds; when the item is returned the first waiting hold becomes ready for its member to borrow.
+Holds are indexed by ID, by member and by (member, item) so that placing, cancelling and listing holds does not
+depend on the number of outstanding holds. Cancelled holds are left in their item's queue and skipped when the queue
+is promoted.
+"""
+
+import collections
+import datetime
+
+WAITING = "Waiting"
+READY = "Ready"
+
+
+class Hold:
+    """
+    A hold contains a unique ID, the held item, the member who placed it, the date it was placed and its status.
+    """
+
+    def __init__(self, hold_id, item_id, member_id, placed_date, status=WAITING):
+        self.hold_id = hold_id
+        self.item_id = item_id
+        self.member_id = member_id
+        self.placed_date = placed_date
+        self.status = status
+
+    def __str__(self):
+        return (
+            f"Hold ID: {self.hold_id} Item ID: {self.item_id} Placed on: {self.placed_date} Status: {self.status}"
+        )
+
+
+def parse_hold(fields):
+    # Parse a record of the holds file.
+    hold_id, item_id, member_id, placed_date, status = fields
+    return Hold(hold_id, item_id, member_id, datetime.date.fromisoformat(placed_date), status)
+
+
+class HoldStore:
+    """
+    Stores the holds and their per-item queues.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # Hold ID -> Hold
+        self.holds = {}
+        # Item ID -> deque of waiting hold IDs, oldest first
+        self.queues = {}
+        # Member ID -> {Hold ID -> Hold}
+        self.member_holds = {}
+        # (Member ID, Item ID) -> Hold
+        self.member_item_holds = {}
+        # Item ID -> {Hold ID -> Hold}, waiting and ready
+        self.item_holds = {}
+        self.last_hold_id = 0
+
+    def add(self, hold):
+        self.holds[hold.hold_id] = hold
+        self.member_holds.setdefault(hold.member_id, {})[hold.hold_id] = hold
+        self.member_item_holds[(hold.member_id, hold.item_id)] = hold
+        self.item_holds.setdefault(hold.item_id, {})[hold.hold_id] = hold
+        if hold.status == WAITING:
+            self.queues.setdefault(hold.item_id, collections.deque()).append(hold.hold_id)
+        self.last_hold_id = max(self.last_hold_id, int(hold.hold_id))
+
+    def remove(self, hold):
+        del self.holds[hold.hold_id]
+        member_holds = self.member_holds[hold.member_id]
+        del member_holds[hold.hold_id]
+        if not member_holds:
+            del self.member_holds[hold.member_id]
+        del self.member_item_holds[(hold.member_id, hold.item_id)]
+        item_holds = self.item_holds[hold.item_id]
+        del item_holds[hold.hold_id]
+        if not item_holds:
+            del self.item_holds[hold.item_id]
+
+    def find(self, member_id, item_id):
+        return self.member_item_holds.get((member_id, item_id))
+
+    def ready(self, item_id):
+        """
+        Returns the ready hold of the item, or None if the item is not waiting for anyone.
+        """
+        for hold in self.item_holds.get(item_id, {}).values():
+            if hold.status == READY:
+                return hold
+        return None
+
+    def count(self, item_id):
+        # Number of waiting and ready holds on the item
+        return len(self.item_holds.get(item_id, {}))
+
+    def place(self, item_id, member_id, placed_date=None):
+        """
+        Places a hold at the back of the item's queue. Returns None if the member already holds the item.
+        """
+        if (member_id, item_id) in self.member_item_holds:
+            return None
+        hold = Hold(str(self.last_hold_id + 1), item_id, member_id, placed_date or datetime.date.today())
+        self.add(hold)
+        return hold
+
+    def cancel(self, hold_id, member_id=None):
+        """
+        Cancels a hold, optionally checking that it belongs to the member. Returns the hold or None.
+        """
+        hold = self.holds.get(hold_id)
+        if hold is None or (member_id is not None and hold.member_id != member_id):
+            return None
+        self.remove(hold)
+        return hold
+
+    def promote(self, item_id):
+        """
+        Marks the first waiting hold of the item as ready and returns it (None if nobody is waiting).
+        """
+        queue = self.queues.get(item_id)
+        while queue:
+            hold = self.holds.get(queue.popleft())
+            # Cancelled holds are skipped.
+            if hold is not None and hold.status == WAITING:
+                hold.status = READY
+                if not queue:
+                    del self.queues[item_id]
+                return hold
+        self.queues.pop(item_id, None)
+        return None
+
+    def position(self, hold):
+        """
+        The position (from 1) of a waiting hold in its item's queue.
+        """
+        position = 0
+        for hold_id in self.queues.get(hold.item_id, ()):
+            if hold_id in self.holds:
+                position += 1
+            if hold_id == hold.hold_id:
+                return position
+        return None
+
+    def for_member(self, member_id):
+        return list(self.member_holds.get(member_id, {}).values())
+
+    def build(self, holds):
+        """
+        Rebuilds the store. Queues are ordered by hold ID, which is the order the holds were placed in.
+        """
+        self.clear()
+        for hold in sorted(holds, key=lambda hold: int(hold.hold_id)):
+            self.add(hold)
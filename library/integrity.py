@@ -0,0 +1,288 @@
+"""
+Referential integrity checks and repairs of the data files.
+
+Deleting a library keeps the borrowings of its items, and deleting items or members leaves their borrowings and holds
+behind. The checker reads each data file once, in dependency order (libraries, items, members, borrowings, holds), and
+keeps the IDs of the good records of each file in a set. Foreign keys are checked against the sets of the files read
+before, so every reference is a single hash lookup. Only the ID sets are kept in memory, not the records.
+
+Each bad record is reported as one of:
+    - malformed: the line cannot be decoded, has the wrong number of fields or an invalid value.
+    - duplicate: its ID was already used by an earlier record of the file, which is the one kept.
+    - orphan: it refers to a library, item or member which does not exist (or is itself bad).
+
+With --quarantine the bad records are moved out of the data files into the quarantine directory, where they are
+appended as they were so that they can be inspected or restored. The data files are replaced atomically.
+
+Usage:
+    python -m library.integrity --data-dir data
+    python -m library.integrity --data-dir data --quarantine
+"""
+
+import argparse
+import collections
+import datetime
+import itertools
+import os
+import sys
+
+from library.codec import CodecError, decoder_for
+from library.holds import READY, WAITING
+
+MALFORMED = "malformed"
+DUPLICATE = "duplicate"
+ORPHAN = "orphan"
+PROBLEMS = [MALFORMED, DUPLICATE, ORPHAN]
+
+ITEM_TYPES = {"Book", "Article", "Digital Media"}
+HOLD_STATUSES = {WAITING, READY}
+
+
+def is_date(value):
+    try:
+        datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def is_id(value):
+    return value is not None and value != ""
+
+
+class FileReport:
+    """
+    The problems found in one data file: a count per kind of problem and the first few examples of each.
+    """
+
+    def __init__(self, filename, examples=10):
+        self.filename = filename
+        self.examples = examples
+        self.rows = 0
+        self.missing = False
+        self.counts = collections.Counter()
+        # Kind of problem -> [(line number, detail)]
+        self.problems = {problem: [] for problem in PROBLEMS}
+
+    def add(self, line_number, problem, detail):
+        self.counts[problem] += 1
+        if len(self.problems[problem]) < self.examples:
+            self.problems[problem].append((line_number, detail))
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def __str__(self):
+        if self.missing:
+            return f"{self.filename}: missing"
+        lines = [f"{self.filename}: {self.rows} records, {self.total} with problems"]
+        for problem in PROBLEMS:
+            if self.counts[problem]:
+                lines.append(f"  {self.counts[problem]} {problem}")
+                for line_number, detail in self.problems[problem]:
+                    lines.append(f"    line {line_number}: {detail}")
+                if self.counts[problem] > len(self.problems[problem]):
+                    lines.append(f"    ... and {self.counts[problem] - len(self.problems[problem])} more")
+        return "\n".join(lines)
+
+
+class IntegrityChecker:
+    """
+    Checks (and optionally repairs) the data files of a directory. The check methods validate the decoded fields of
+    a record and return None for a good record or a (problem, detail) pair.
+    """
+
+    def __init__(self, data_dir="data", quarantine_dir=None, examples=10):
+        self.data_dir = data_dir
+        # Bad records are only moved out of the data files if a quarantine directory is given.
+        self.quarantine_dir = quarantine_dir
+        self.examples = examples
+        self.library_ids = set()
+        self.item_ids = set()
+        self.member_ids = set()
+        self.borrowing_ids = set()
+        self.hold_ids = set()
+        self.reports = []
+
+    def check_library(self, fields):
+        library_id = fields[0]
+        if not is_id(library_id):
+            return MALFORMED, "empty library ID"
+        if library_id in self.library_ids:
+            return DUPLICATE, f"library ID {library_id}"
+        self.library_ids.add(library_id)
+        return None
+
+    def check_item(self, fields):
+        item_id, library_id, item_type = fields[0], fields[1], fields[2]
+        if not is_id(item_id):
+            return MALFORMED, "empty item ID"
+        if item_type not in ITEM_TYPES:
+            return MALFORMED, f"item {item_id} has an invalid type {item_type!r}"
+        if item_id in self.item_ids:
+            return DUPLICATE, f"item ID {item_id}"
+        if library_id not in self.library_ids:
+            return ORPHAN, f"item {item_id} belongs to library {library_id} which does not exist"
+        self.item_ids.add(item_id)
+        return None
+
+    def check_member(self, fields):
+        member_id = fields[0]
+        if not is_id(member_id):
+            return MALFORMED, "empty member ID"
+        if member_id in self.member_ids:
+            return DUPLICATE, f"member ID {member_id}"
+        self.member_ids.add(member_id)
+        return None
+
+    def check_borrowing(self, fields):
+        borrowing_id, item_id, member_id, borrow_date, return_date = fields
+        # Borrowing IDs are numbered.
+        if borrowing_id is None or not borrowing_id.isdigit():
+            return MALFORMED, f"invalid borrowing ID {borrowing_id!r}"
+        if not is_date(borrow_date) or (return_date is not None and not is_date(return_date)):
+            return MALFORMED, f"borrowing {borrowing_id} has an invalid date"
+        if borrowing_id in self.borrowing_ids:
+            return DUPLICATE, f"borrowing ID {borrowing_id}"
+        if item_id not in self.item_ids:
+            return ORPHAN, f"borrowing {borrowing_id} refers to item {item_id} which does not exist"
+        if member_id not in self.member_ids:
+            return ORPHAN, f"borrowing {borrowing_id} refers to member {member_id} which does not exist"
+        self.borrowing_ids.add(borrowing_id)
+        return None
+
+    def check_hold(self, fields):
+        hold_id, item_id, member_id, placed_date, status = fields
+        if hold_id is None or not hold_id.isdigit():
+            return MALFORMED, f"invalid hold ID {hold_id!r}"
+        if not is_date(placed_date) or status not in HOLD_STATUSES:
+            return MALFORMED, f"hold {hold_id} has an invalid date or status"
+        if hold_id in self.hold_ids:
+            return DUPLICATE, f"hold ID {hold_id}"
+        if item_id not in self.item_ids:
+            return ORPHAN, f"hold {hold_id} refers to item {item_id} which does not exist"
+        if member_id not in self.member_ids:
+            return ORPHAN, f"hold {hold_id} refers to member {member_id} which does not exist"
+        self.hold_ids.add(hold_id)
+        return None
+
+    def run(self):
+        """
+        Checks every data file. Returns the list of FileReports.
+        """
+        # Files in dependency order with their number of fields, whether they must exist and their check.
+        files = [
+            ("library.txt", 2, True, self.check_library),
+            ("items.txt", 7, True, self.check_item),
+            ("members.txt", 4, True, self.check_member),
+            ("borrowing.txt", 5, True, self.check_borrowing),
+            ("holds.txt", 5, False, self.check_hold),
+        ]
+        self.reports = []
+        for filename, count, required, check in files:
+            report = FileReport(filename, self.examples)
+            path = os.path.join(self.data_dir, filename)
+            if os.path.exists(path):
+                self.check_file(path, count, check, report)
+            else:
+                # A missing file counts as empty; holds.txt only exists once a hold has been placed.
+                report.missing = required
+            self.reports.append(report)
+        return self.reports
+
+    def check_file(self, path, count, check, report):
+        """
+        Checks the records of a file in one pass. When quarantining, the good lines are copied to a temporary file
+        which replaces the data file if any bad line was found.
+        """
+        kept = quarantined = None
+        if self.quarantine_dir is not None:
+            kept = open(path + ".tmp", "w")
+        try:
+            with open(path, "r") as file:
+                first_line = file.readline()
+                decode, is_header = decoder_for(first_line)
+                if is_header:
+                    if kept is not None:
+                        kept.write(first_line)
+                    lines = file
+                    line_number = 2
+                else:
+                    # The first line of a legacy file is a record (unless the file is empty).
+                    lines = itertools.chain([first_line] if first_line else [], file)
+                    line_number = 1
+
+                for line in lines:
+                    report.rows += 1
+                    try:
+                        problem = check(decode(line, count))
+                    except CodecError as error:
+                        problem = MALFORMED, str(error)
+                    if problem is None:
+                        if kept is not None:
+                            kept.write(line)
+                    else:
+                        report.add(line_number, *problem)
+                        if kept is not None:
+                            if quarantined is None:
+                                quarantined = self.open_quarantine(os.path.basename(path), first_line, is_header)
+                            quarantined.write(line if line.endswith("\n") else line + "\n")
+                    line_number += 1
+        except BaseException:
+            if kept is not None:
+                kept.close()
+                os.remove(kept.name)
+            raise
+        finally:
+            if quarantined is not None:
+                quarantined.close()
+
+        if kept is not None:
+            kept.close()
+            if report.total:
+                os.replace(kept.name, path)
+            else:
+                os.remove(kept.name)
+
+    def open_quarantine(self, filename, first_line, is_header):
+        os.makedirs(self.quarantine_dir, exist_ok=True)
+        path = os.path.join(self.quarantine_dir, filename)
+        is_new = not os.path.exists(path)
+        file = open(path, "a")
+        # The quarantined lines keep the format of the file they came from.
+        if is_new and is_header:
+            file.write(first_line)
+        return file
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the referential integrity of the data files.")
+    parser.add_argument("--data-dir", default="data", help="Directory of the data files")
+    parser.add_argument("--quarantine", action="store_true", help="Move the bad records out of the data files")
+    parser.add_argument(
+        "--quarantine-dir", help="Where quarantined records are appended (default: the quarantine folder of the data)"
+    )
+    parser.add_argument("--examples", type=int, default=10, help="Number of problems shown per kind and file")
+    args = parser.parse_args(argv)
+
+    quarantine_dir = None
+    if args.quarantine:
+        quarantine_dir = args.quarantine_dir or os.path.join(args.data_dir, "quarantine")
+    checker = IntegrityChecker(args.data_dir, quarantine_dir, args.examples)
+    reports = checker.run()
+    for report in reports:
+        print(report)
+
+    total = sum(report.total for report in reports)
+    if total == 0 and not any(report.missing for report in reports):
+        print("No problems found")
+    elif quarantine_dir is not None:
+        print(f"Moved {total} records to {quarantine_dir}")
+    else:
+        # A failing exit status for scripts running the check.
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
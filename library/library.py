@@ -1,6 +1,23 @@
+import contextlib
+import copy
 import datetime
+import functools
+import os
 import re
 import sys
+import threading
+import weakref
+
+from library.codec import encode_records, read_records, write_header
+from library.events import EventBus
+from library.export import FORMATS, export
+from library.holds import READY, HoldStore, parse_hold
+from library.loader import load_files_parallel
+from library.loans import LoanIndex
+from library.metrics import instrument, metrics
+from library.query import Index, Query, RangeIndex, Source, get_attribute, get_key, group_lookup, unique_lookup
+from library.render import RenderCache, render_lines, write
+from library.snapshot import SNAPSHOT_COLLECTIONS, Snapshot
 
 
 class Library:
@@ -119,6 +136,104 @@ class Member:
         self.email = email
 
 
+def parse_library(fields):
+    # Parse a record of the library file.
+    library_id, name = fields
+    return Library(library_id, name)
+
+
+def parse_item(fields):
+    # Parse a record of the items file.
+    item_id, library_id, item_type, name, book_author, article_journal, media_format = fields
+    if item_type == "Book":
+        item = Book(item_id, library_id, name, book_author)
+    elif item_type == "Article":
+        item = Article(item_id, library_id, name, article_journal)
+    elif item_type == "Digital Media":
+        item = DigitalMedia(item_id, library_id, name, media_format)
+    return item
+
+
+def parse_member(fields):
+    # Parse a record of the members file.
+    member_id, first_name, last_name, email = fields
+    return Member(member_id, first_name, last_name, email)
+
+
+def parse_borrowing(fields):
+    # Parse a record of the borrowing file.
+    borrowing_id, item_id, member_id, borrow_date, return_date = fields
+    borrowing = {
+        "borrowing_id": borrowing_id,
+        "item_id": item_id,
+        "member_id": member_id,
+        "borrow_date": datetime.date.fromisoformat(borrow_date),
+    }
+
+    # If the book is not returned, the return date will be a Null value.
+    if return_date is not None:
+        return_date = datetime.date.fromisoformat(return_date)
+    borrowing["return_date"] = return_date
+
+    return borrowing
+
+
+def borrowing_fields(borrowing):
+    # The fields of a record of the borrowing file.
+    return_date = borrowing["return_date"]
+    # If the book is not returned, the return date will be a Null value.
+    if return_date is not None:
+        return_date = return_date.isoformat()
+    return [
+        borrowing["borrowing_id"],
+        borrowing["item_id"],
+        borrowing["member_id"],
+        borrowing["borrow_date"].isoformat(),
+        return_date,
+    ]
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    # The data is written to a temporary file which only replaces the file once it has been completely written.
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, "w") as file:
+            yield file
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def exclusive(method):
+    # Runs a method of LibraryManagementSystem holding its writer lock, so that changes are made one at a time and
+    # snapshots are never taken in the middle of one.
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.write_lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def borrowing_record(borrowing):
+    # The fields of a borrowing with the dates as ISO strings.
+    record = dict(borrowing)
+    record["borrow_date"] = borrowing["borrow_date"].isoformat()
+    if borrowing["return_date"] is not None:
+        record["return_date"] = borrowing["return_date"].isoformat()
+    return record
+
+
+def hold_record(hold):
+    # The fields of a hold with the placed date as an ISO string.
+    record = dict(vars(hold))
+    record["placed_date"] = hold.placed_date.isoformat()
+    return record
+
+
 class LibraryManagementSystem:
     """
     This class acts as an interface for the library.
@@ -128,133 +243,388 @@ class LibraryManagementSystem:
         - Add/Edit/Delete Libraries
         - Add/Edit/Delete Items
         - Add/Edit/Delete Members
-        - Borrow an item
-        - Return an item
+        - Borrow and return items, one or several at once
+        - Place/Cancel holds on items
+        - Query the items and borrowings (catalogue, ledger) and list overdue loans
+        - Take read-only snapshots of the collections
+    The data directory defaults to 'data' but can be changed to work on another set of data files.
     """
 
-    def __init__(self):
+    COLLECTIONS = ["libraries", "items", "members", "borrowings", "holds"]
+    DATA_FILES = {
+        "libraries": "library.txt",
+        "items": "items.txt",
+        "members": "members.txt",
+        "borrowings": "borrowing.txt",
+        "holds": "holds.txt",
+    }
+    # Attributes set when a collection is loaded -> that collection
+    LAZY_ATTRIBUTES = {
+        "libraries": "libraries",
+        "items": "items",
+        "item_index": "items",
+        "library_items": "items",
+        "members": "members",
+        "borrowings": "borrowings",
+        "loans": "borrowings",
+        "holds": "holds",
+    }
+
+    def __init__(self, data_dir="data", events=None, loan_periods=None):
+        self.data_dir = data_dir
+        # The collections loaded so far. The attributes of the others are set when they are first accessed:
+        #   libraries, items, members, borrowings: lists of records
+        #   item_index: Item ID -> Item
+        #   library_items: Library ID -> {Item ID -> Item}
+        #   loans: LoanIndex of the borrowings
+        #   holds: HoldStore
+        self.loaded = set()
+        self.loan_periods = loan_periods
+        # Collection -> generation, increased whenever it changes, and the generation last written to its file
+        self.generations = {collection: 0 for collection in self.COLLECTIONS}
+        self.saved_generations = dict(self.generations)
+        # Library ID -> generation of the library's listings
+        self.library_generations = {}
+        self.render_cache = RenderCache()
+        self.events = events if events is not None else EventBus()
+        self.write_lock = threading.RLock()
+        # The live snapshots, which writers copy collections and records for
+        self.snapshots = weakref.WeakSet()
+
+    def __getattr__(self, name):
+        # Only called for attributes which are not set, i.e. those of collections which have not been loaded yet.
+        collection = self.LAZY_ATTRIBUTES.get(name)
+        if collection is None or collection in self.__dict__.get("loaded", ()):
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        self.load(collection)
+        return self.__dict__[name]
+
+    def load(self, *collections):
+        # Load the collections which have not been loaded yet.
+        loaders = {
+            "libraries": self.load_libraries,
+            "items": self.load_items,
+            "members": self.load_members,
+            "borrowings": self.load_borrowings,
+            "holds": self.load_holds,
+        }
+        for collection in collections:
+            if collection not in self.loaded:
+                loaders[collection]()
+
+    def create_empty(self):
+        # Start with empty collections instead of loading the data files, e.g. to fill a new data directory.
         self.libraries = []
         self.items = []
         self.members = []
         self.borrowings = []
+        self.index_items()
+        self.index_borrowings()
+        self.holds = HoldStore()
+        self.loaded.update(self.COLLECTIONS)
+
+    @instrument("snapshot")
+    def snapshot(self):
+        """
+        Returns a point-in-time view of the libraries, items, members and borrowings. Nothing is copied until the next
+        change, which copies only the list it changes.
+        """
+        with self.write_lock:
+            lists = {collection: getattr(self, collection) for collection in SNAPSHOT_COLLECTIONS}
+            snapshot = Snapshot(lists, self.snapshots)
+            self.snapshots.add(snapshot)
+        return snapshot
+
+    def writable(self, collection):
+        # The list of a collection, to be changed in place. It is copied first if a live snapshot shares it.
+        records = getattr(self, collection)
+        for snapshot in list(self.snapshots):
+            if snapshot.lists.get(collection) is records:
+                records = list(records)
+                setattr(self, collection, records)
+                break
+        return records
+
+    def replace(self, collection, record, replacement):
+        # Records are never changed in place: a change is made to a copy which takes the place of the record, so that
+        # snapshots and readers holding the record keep seeing it as it was.
+        records = self.writable(collection)
+        records[records.index(record)] = replacement
+
+    def data_path(self, filename):
+        return os.path.join(self.data_dir, filename)
+
+    def mark_changed(self, collection):
+        # A collection has been modified in memory and differs from what was last saved.
+        self.generations[collection] += 1
+
+    def mark_saved(self, collection):
+        self.saved_generations[collection] = self.generations[collection]
+
+    def is_changed(self, collection):
+        return self.generations[collection] != self.saved_generations[collection]
+
+    def touch_library(self, library_id):
+        # The listings of the library are rendered again the next time they are shown.
+        self.library_generations[library_id] = self.library_generations.get(library_id, 0) + 1
+
+    def index_items(self):
+        # Rebuild the item indexes from the list of items.
+        self.item_index = {}
+        self.library_items = {}
+        self.render_cache.clear()
+        for item in self.items:
+            self.add_item_to_index(item)
+
+    def add_item_to_index(self, item):
+        self.item_index[item.item_id] = item
+        self.library_items.setdefault(item.library_id, {})[item.item_id] = item
+
+    def remove_item_from_index(self, item):
+        del self.item_index[item.item_id]
+        bucket = self.library_items[item.library_id]
+        del bucket[item.item_id]
+        if not bucket:
+            del self.library_items[item.library_id]
+
+    def item_type_of(self, item_id):
+        item = self.item_index.get(item_id)
+        return item.item_type if item is not None else None
+
+    def index_borrowings(self):
+        # Rebuild the loan indexes from the list of borrowings.
+        self.loans = LoanIndex(self.loan_periods)
+        self.loans.build(self.borrowings, self.item_type_of)
+
+    @property
+    def catalogue(self):
+        # Query over the items, e.g. self.catalogue.where(library_id="1", item_type="Book").order_by("name")
+        return Query(
+            Source(
+                "items",
+                self.items,
+                get_attribute,
+                indexes=[
+                    Index("item_index", ["item_id"], unique_lookup(self.item_index)),
+                    Index("library_items", ["library_id"], group_lookup(self.library_items)),
+                ],
+            )
+        )
 
-    def load_data(self):
+    @property
+    def ledger(self):
+        # Query over the borrowings, e.g. self.ledger.where(member_id="1", return_date=None)
+        loans = self.loans
+        return Query(
+            Source(
+                "borrowings",
+                self.borrowings,
+                get_key,
+                indexes=[
+                    Index("borrowings", ["borrowing_id"], unique_lookup(loans.borrowings)),
+                    Index("member_borrowings", ["member_id"], group_lookup(loans.member_borrowings)),
+                ],
+                range_indexes=[
+                    RangeIndex("borrow_dates", "borrow_date", loans.borrowed_between),
+                    RangeIndex("return_dates", "return_date", loans.returned_between),
+                ],
+            )
+        )
+
+    @instrument("load_data")
+    @exclusive
+    def load_data(self, parallel=False, workers=None):
         # Load data into memory from the files.
+        # In parallel mode the files are parsed concurrently and large files are split across processes.
+        if parallel:
+            self.load_data_parallel(workers)
+            return
+
         self.load_libraries()
         self.load_items()
         self.load_members()
         self.load_borrowings()
-
+        self.load_holds()
+
+    @instrument("load_data_parallel")
+    def load_data_parallel(self, workers=None):
+        records = load_files_parallel(
+            {
+                "libraries": (self.data_path("library.txt"), parse_library),
+                "items": (self.data_path("items.txt"), parse_item),
+                "members": (self.data_path("members.txt"), parse_member),
+                "borrowings": (self.data_path("borrowing.txt"), parse_borrowing),
+            },
+            workers,
+        )
+        self.libraries = records["libraries"]
+        self.render_cache.clear()
+        self.items = records["items"]
+        self.index_items()
+        self.members = records["members"]
+        self.borrowings = records["borrowings"]
+        self.index_borrowings()
+        self.loaded.update(["libraries", "items", "members", "borrowings"])
+        self.load_holds()
+
+    @instrument("load_libraries")
     def load_libraries(self):
-        with open("data/library.txt", "r") as file:
-            for line in file:
-                library_id, name = line.strip().split(",")
-                library = Library(library_id, name)
-                self.libraries.append(library)
+        self.libraries = []
+        with open(self.data_path("library.txt"), "r") as file:
+            for fields in read_records(file):
+                self.libraries.append(parse_library(fields))
+        self.render_cache.clear()
+        self.loaded.add("libraries")
 
+    @instrument("load_items")
     def load_items(self):
-        with open("data/items.txt", "r") as file:
-            for line in file:
-                item_id, library_id, item_type, name, book_author, article_journal, media_format = line.strip().split(
-                    ","
-                )
-                if item_type == "Book":
-                    item = Book(item_id, library_id, name, book_author)
-                elif item_type == "Article":
-                    item = Article(item_id, library_id, name, article_journal)
-                elif item_type == "Digital Media":
-                    item = DigitalMedia(item_id, library_id, name, media_format)
-                self.items.append(item)
+        self.items = []
+        with open(self.data_path("items.txt"), "r") as file:
+            for fields in read_records(file):
+                self.items.append(parse_item(fields))
+        self.index_items()
+        self.loaded.add("items")
 
+    @instrument("load_members")
     def load_members(self):
-        with open("data/members.txt", "r") as file:
-            for line in file:
-                member_id, first_name, last_name, email = line.strip().split(",")
-                member = Member(member_id, first_name, last_name, email)
-                self.members.append(member)
+        self.members = []
+        with open(self.data_path("members.txt"), "r") as file:
+            for fields in read_records(file):
+                self.members.append(parse_member(fields))
+        self.loaded.add("members")
 
+    @instrument("load_borrowings")
     def load_borrowings(self):
-        with open("data/borrowing.txt", "r") as file:
-            for line in file:
-                borrowing_id, item_id, member_id, borrow_date, return_date = line.strip().split(",")
-                borrowing = {
-                    "borrowing_id": borrowing_id,
-                    "item_id": item_id,
-                    "member_id": member_id,
-                    "borrow_date": datetime.datetime.strptime(borrow_date, "%Y-%m-%d").date(),
-                }
-
-                # If the book is not returned, the return date will be a Null value.
-                try:
-                    return_date = datetime.datetime.strptime(return_date, "%Y-%m-%d").date()
-                except ValueError:
-                    return_date = None
-                borrowing["return_date"] = return_date
-
-                self.borrowings.append(borrowing)
-
-    def save_data(self):
+        self.borrowings = []
+        with open(self.data_path("borrowing.txt"), "r") as file:
+            for fields in read_records(file):
+                self.borrowings.append(parse_borrowing(fields))
+        self.index_borrowings()
+        self.loaded.add("borrowings")
+
+    @instrument("load_holds")
+    def load_holds(self):
+        holds = []
+        try:
+            with open(self.data_path("holds.txt"), "r") as file:
+                for fields in read_records(file):
+                    holds.append(parse_hold(fields))
+        except FileNotFoundError:
+            # No holds have been placed yet.
+            pass
+        self.holds = HoldStore()
+        self.holds.build(holds)
+        self.loaded.add("holds")
+
+    @instrument("save_data")
+    @exclusive
+    def save_data(self, force=False):
         # Save data from memory into the files.
-
-        self.save_libraries()
-        self.save_items()
-        self.save_members()
-        self.save_borrowings()
-
+        # Only collections which changed since they were last saved are written unless force is set.
+        # Collections which were never loaded are left alone since their files are unchanged.
+
+        if self.needs_saving("libraries", force):
+            self.save_libraries()
+        if self.needs_saving("items", force):
+            self.save_items()
+        if self.needs_saving("members", force):
+            self.save_members()
+        if self.needs_saving("borrowings", force):
+            self.save_borrowings()
+        if self.needs_saving("holds", force):
+            self.save_holds()
+
+    def needs_saving(self, collection, force=False):
+        return collection in self.loaded and (force or self.is_changed(collection))
+
+    @instrument("save_libraries")
     def save_libraries(self):
-        with open("data/library.txt", "w") as file:
-            for library in self.libraries:
-                file.write(f"{library.library_id},{library.name}\n")
+        with atomic_write(self.data_path("library.txt")) as file:
+            write_header(file)
+            file.writelines(encode_records([library.library_id, library.name] for library in self.libraries))
+            metrics.observe_bytes("save_libraries", file.tell())
+        self.mark_saved("libraries")
 
+    @instrument("save_items")
     def save_items(self):
-        with open("data/items.txt", "w") as file:
-            for item in self.items:
-                file.write(
-                    (
-                        f"{item.item_id},{item.library_id},{item.item_type},{item.name},{item.book_author},"
-                        f"{item.article_journal},{item.media_format}\n"
-                    )
+        with atomic_write(self.data_path("items.txt")) as file:
+            write_header(file)
+            file.writelines(
+                encode_records(
+                    [
+                        item.item_id,
+                        item.library_id,
+                        item.item_type,
+                        item.name,
+                        item.book_author,
+                        item.article_journal,
+                        item.media_format,
+                    ]
+                    for item in self.items
                 )
+            )
+            metrics.observe_bytes("save_items", file.tell())
+        self.mark_saved("items")
 
+    @instrument("save_members")
     def save_members(self):
-        with open("data/members.txt", "w") as file:
-            for member in self.members:
-                file.write(f"{member.member_id},{member.first_name},{member.last_name},{member.email}\n")
+        with atomic_write(self.data_path("members.txt")) as file:
+            write_header(file)
+            file.writelines(
+                encode_records(
+                    [member.member_id, member.first_name, member.last_name, member.email] for member in self.members
+                )
+            )
+            metrics.observe_bytes("save_members", file.tell())
+        self.mark_saved("members")
 
+    @instrument("save_borrowings")
     def save_borrowings(self):
-        with open("data/borrowing.txt", "w") as file:
-            for borrowing in self.borrowings:
-                borrow_date = borrowing["borrow_date"].strftime("%Y-%m-%d")
-                # If the book is not returned, the return date will be a Null value.
-                try:
-                    return_date = borrowing["return_date"].strftime("%Y-%m-%d")
-                except AttributeError:
-                    return_date = None
-                file.write(
-                    (
-                        f"{borrowing['borrowing_id']},{borrowing['item_id']},{borrowing['member_id']},{borrow_date},"
-                        f"{return_date}\n"
-                    )
+        with atomic_write(self.data_path("borrowing.txt")) as file:
+            write_header(file)
+            file.writelines(encode_records(borrowing_fields(borrowing) for borrowing in self.borrowings))
+            metrics.observe_bytes("save_borrowings", file.tell())
+        self.mark_saved("borrowings")
+
+    @instrument("save_holds")
+    def save_holds(self):
+        with atomic_write(self.data_path("holds.txt")) as file:
+            write_header(file)
+            file.writelines(
+                encode_records(
+                    [hold.hold_id, hold.item_id, hold.member_id, hold.placed_date.isoformat(), hold.status]
+                    for hold in self.holds.holds.values()
                 )
+            )
+            metrics.observe_bytes("save_holds", file.tell())
+        self.mark_saved("holds")
 
+    @instrument("find_library")
     def find_library(self, library_id):
+        metrics.observe_scanned("find_library", len(self.libraries))
         has_matches = [library for library in self.libraries if library.library_id == library_id]
         if len(has_matches) == 0:
             return False
         else:
             return True
 
+    @instrument("add_library")
+    @exclusive
     def add_library(self, library_id, name):
         # Library ID should remain unique.
         if self.find_library(library_id):
             return False
 
         library = Library(library_id, name)
-        self.libraries.append(library)
+        self.writable("libraries").append(library)
+        self.mark_changed("libraries")
         self.save_libraries()
+        self.events.publish("add_library", "libraries", library_id, vars(library))
 
         return True
 
+    @instrument("edit_library")
+    @exclusive
     def edit_library(self, library_id, name):
         # Library ID should exists
         if not self.find_library(library_id):
@@ -262,32 +632,73 @@ class LibraryManagementSystem:
 
         for library in self.libraries:
             if library.library_id == library_id:
-                library.edit(name)
+                edited = copy.copy(library)
+                edited.edit(name)
+                self.replace("libraries", library, edited)
+                library = edited
+                self.mark_changed("libraries")
+                self.touch_library(library_id)
                 self.save_libraries()
+                self.events.publish("edit_library", "libraries", library_id, vars(library))
                 break
 
         return True
 
+    @instrument("delete_library")
+    @exclusive
     def delete_library(self, library_id):
         # Library ID should exist
         if not self.find_library(library_id):
             return False
 
+        metrics.observe_scanned("delete_library", len(self.libraries))
         self.libraries = [library for library in self.libraries if library.library_id != library_id]
+        self.mark_changed("libraries")
+        self.touch_library(library_id)
         self.save_libraries()
 
-        self.items = [item for item in self.items if item.library_id != library_id]
-        self.save_items()
+        # Only the items of the library's bucket are removed. The items file is left alone if it had none.
+        library_items = self.library_items.pop(library_id, {})
+        if library_items:
+            metrics.observe_scanned("delete_library", len(self.items))
+            self.items = [item for item in self.items if item.item_id not in library_items]
+            for item_id in library_items:
+                del self.item_index[item_id]
+            self.mark_changed("items")
+            self.save_items()
+
+        self.events.publish("delete_library", "libraries", library_id)
+        # The items deleted along with the library.
+        for item_id in library_items:
+            self.events.publish("delete_library", "items", item_id)
 
         return True
 
+    @instrument("render_libraries")
+    def render_libraries(self):
+        # The listing of all libraries, as shown by the library menu.
+        return self.render_cache.get(
+            "libraries",
+            self.generations["libraries"],
+            lambda: render_lines(self.libraries, "Sorry, there are no libraries available yet. An admin can add them"),
+        )
+
+    @instrument("render_items")
+    def render_items(self, library_id, item_type):
+        # The listing of the items of one type in a library, as shown by the item menus.
+        def render():
+            return render_lines(
+                self.catalogue.where(library_id=library_id, item_type=item_type).all(), "There are no items to display"
+            )
+
+        return self.render_cache.get((library_id, item_type), self.library_generations.get(library_id, 0), render)
+
+    @instrument("find_item")
     def find_item(self, item_id):
-        has_matches = [item for item in self.items if item.item_id == item_id]
-        if len(has_matches) == 0:
-            return False
-        else:
-            return True
+        return item_id in self.item_index
 
+    @instrument("add_item")
+    @exclusive
     def add_item(
         self, item_id, library_id, item_type, name, book_author=None, article_journal=None, media_format=None
     ):
@@ -302,11 +713,17 @@ class LibraryManagementSystem:
         elif item_type == "Digital Media":
             item = DigitalMedia(item_id, library_id, name, media_format)
 
-        self.items.append(item)
+        self.writable("items").append(item)
+        self.add_item_to_index(item)
+        self.touch_library(library_id)
+        self.mark_changed("items")
         self.save_items()
+        self.events.publish("add_item", "items", item_id, vars(item))
 
         return True
 
+    @instrument("edit_item")
+    @exclusive
     def edit_item(
         self, item_id, library_id, item_type, name, book_author=None, article_journal=None, media_format=None
     ):
@@ -314,42 +731,71 @@ class LibraryManagementSystem:
         if not self.find_item(item_id):
             return False
 
-        for item in self.items:
-            if item.item_id == item_id:
-                item.edit(library_id, item_type, name, book_author, article_journal, media_format)
-                self.save_items()
-                break
+        item = self.item_index[item_id]
+        previous_library_id = item.library_id
+        edited = copy.copy(item)
+        edited.edit(library_id, item_type, name, book_author, article_journal, media_format)
+        self.replace("items", item, edited)
+        # An item moving to another library changes bucket. Otherwise it keeps its place in the listings.
+        if library_id != previous_library_id:
+            self.remove_item_from_index(item)
+            self.add_item_to_index(edited)
+        else:
+            self.item_index[item_id] = edited
+            self.library_items[library_id][item_id] = edited
+        item = edited
+        self.touch_library(previous_library_id)
+        self.touch_library(library_id)
+        self.mark_changed("items")
+        self.save_items()
+        self.events.publish("edit_item", "items", item_id, vars(item))
 
         return True
 
+    @instrument("delete_item")
+    @exclusive
     def delete_item(self, item_id):
         # Item ID should remain exist.
         if not self.find_item(item_id):
             return False
 
+        metrics.observe_scanned("delete_item", len(self.items))
+        item = self.item_index[item_id]
+        self.remove_item_from_index(item)
+        self.touch_library(item.library_id)
         self.items = [item for item in self.items if item.item_id != item_id]
+        self.mark_changed("items")
         self.save_items()
+        self.events.publish("delete_item", "items", item_id)
 
         return True
 
+    @instrument("find_member")
     def find_member(self, member_id):
+        metrics.observe_scanned("find_member", len(self.members))
         has_matches = [member for member in self.members if member.member_id == member_id]
         if len(has_matches) == 0:
             return False
         else:
             return True
 
+    @instrument("add_member")
+    @exclusive
     def add_member(self, member_id, first_name, last_name, email):
         # Member ID should remain unique.
         if self.find_member(member_id):
             return False
 
         member = Member(member_id, first_name, last_name, email)
-        self.members.append(member)
+        self.writable("members").append(member)
+        self.mark_changed("members")
         self.save_members()
+        self.events.publish("add_member", "members", member_id, vars(member))
 
         return True
 
+    @instrument("edit_member")
+    @exclusive
     def edit_member(self, member_id, first_name, last_name, email):
         # Member ID should remain exist.
         if not self.find_member(member_id):
@@ -357,77 +803,212 @@ class LibraryManagementSystem:
 
         for member in self.members:
             if member.member_id == member_id:
-                member.edit(first_name, last_name, email)
+                edited = copy.copy(member)
+                edited.edit(first_name, last_name, email)
+                self.replace("members", member, edited)
+                member = edited
+                self.mark_changed("members")
                 self.save_members()
+                self.events.publish("edit_member", "members", member_id, vars(member))
                 break
 
         return True
 
+    @instrument("delete_member")
+    @exclusive
     def delete_member(self, member_id):
         # Member ID should remain exist.
         if not self.find_member(member_id):
             return False
 
+        metrics.observe_scanned("delete_member", len(self.members))
         self.members = [member for member in self.members if member.member_id != member_id]
+        self.mark_changed("members")
         self.save_members()
+        self.events.publish("delete_member", "members", member_id)
 
         return True
 
+    @instrument("find_borrowing_transaction")
     def find_borrowing_transaction(self, borrowing_id):
-        has_matches = [transaction for transaction in self.borrowings if transaction["borrowing_id"] == borrowing_id]
-        if len(has_matches) == 0:
-            return False
-        else:
-            return True
+        return borrowing_id in self.loans.borrowings
 
+    @instrument("find_maximum_borrowing_id")
     def find_maximum_borrowing_id(self):
-        # Least possible number of items expected (No borrowings yet)
-        maximum = 0
-        for transaction in self.borrowings:
-            if int(transaction["borrowing_id"]) > maximum:
-                maximum = int(transaction["borrowing_id"])
-        return maximum
-
+        # Least possible number of items expected (No borrowings yet) is 0.
+        return self.loans.last_borrowing_id
+
+    @instrument("overdue_borrowings")
+    def overdue_borrowings(self, library_id=None, today=None):
+        # Open loans past their due date, most overdue first. Optionally only those of a library's items.
+        overdue = self.loans.overdue(today)
+        if library_id is not None:
+            library_items = self.library_items.get(library_id, {})
+            overdue = [borrowing for borrowing in overdue if borrowing["item_id"] in library_items]
+        return overdue
+
+    @instrument("borrow_item")
     def borrow_item(self, item_id, member_id):
-        # Check if a member already has borrowed the item and hasn't returned it. (Shouldn't be able to borrow)
-        match = False
-        for transaction in self.borrowings:
-            if (
-                transaction["item_id"] == item_id
-                and transaction["member_id"] == member_id
-                and transaction["return_date"] is None
-            ):
-                match = True
-                break
-        if match:
+        return self.borrow_items([item_id], member_id)
+
+    @instrument("borrow_items")
+    @exclusive
+    def borrow_items(self, item_ids, member_id):
+        """
+        Borrows several items for a member at once. Either all the items are borrowed or none of them.
+        Every item should exist, appear once, not be on loan (to anyone) and not be kept for another member's ready
+        hold. All the loans are saved with a single write of the borrowing file.
+        """
+        if len(item_ids) == 0 or len(set(item_ids)) != len(item_ids):
             return False
+        for item_id in item_ids:
+            # An item which is borrowed and not returned yet can not be borrowed again.
+            if not self.find_item(item_id) or self.loans.is_borrowed(item_id):
+                return False
+            # An item whose hold is ready is kept for the member who placed it.
+            hold = self.holds.ready(item_id)
+            if hold is not None and hold.member_id != member_id:
+                return False
+
+        # Borrowing IDs should remain unique. A block of IDs is allocated after the highest one.
+        first_borrowing_id = self.find_maximum_borrowing_id() + 1
+        borrow_date = datetime.date.today()
+        borrowings = []
+        for offset, item_id in enumerate(item_ids):
+            borrowing = {
+                "borrowing_id": str(first_borrowing_id + offset),
+                "item_id": item_id,
+                "member_id": member_id,
+                "borrow_date": borrow_date,
+                "return_date": None,
+            }
+            borrowings.append(borrowing)
+
+        self.writable("borrowings").extend(borrowings)
+        for borrowing in borrowings:
+            self.loans.add(borrowing)
+        self.mark_changed("borrowings")
+        try:
+            self.save_borrowings()
+        except OSError:
+            # Nothing was written, so none of the loans are kept.
+            del self.borrowings[-len(borrowings) :]
+            self.index_borrowings()
+            raise
+        for borrowing in borrowings:
+            self.events.publish("borrow_item", "borrowings", borrowing["borrowing_id"], borrowing_record(borrowing))
+
+        # Ready holds of the member on the items have been collected.
+        collected = []
+        for item_id in item_ids:
+            hold = self.holds.find(member_id, item_id)
+            if hold is not None and hold.status == READY:
+                self.holds.remove(hold)
+                collected.append(hold)
+        if collected:
+            self.mark_changed("holds")
+            self.save_holds()
+        for hold in collected:
+            self.events.publish("borrow_item", "holds", hold.hold_id)
 
-        # Borrowing ID should remain unique.
-        borrowing_id = str(self.find_maximum_borrowing_id() + 1)
+        return True
 
-        while self.find_borrowing_transaction(borrowing_id):
-            borrowing_id += 1
+    @instrument("return_item")
+    def return_item(self, borrowing_id):
+        return self.return_items([borrowing_id])
 
-        borrow_date = datetime.date.today()
-        return_date = None
-        borrowing = {
-            "borrowing_id": borrowing_id,
-            "item_id": item_id,
-            "member_id": member_id,
-            "borrow_date": borrow_date,
-            "return_date": return_date,
-        }
-        self.borrowings.append(borrowing)
-        self.save_borrowings()
+    @instrument("return_items")
+    @exclusive
+    def return_items(self, borrowing_ids, member_id=None):
+        """
+        Returns several borrowed items at once. Either all the items are returned or none of them.
+        Every borrowing should exist, appear once, be unreturned and belong to the member (if given).
+        All the returns are saved with a single write of the borrowing file.
+        """
+        if len(borrowing_ids) == 0 or len(set(borrowing_ids)) != len(borrowing_ids):
+            return False
+        borrowings = []
+        for borrowing_id in borrowing_ids:
+            borrowing = self.loans.borrowings.get(borrowing_id)
+            if borrowing is None or borrowing["return_date"] is not None:
+                return False
+            if member_id is not None and borrowing["member_id"] != member_id:
+                return False
+            borrowings.append(borrowing)
+
+        return_date = datetime.date.today()
+        open_loans = borrowings
+        borrowings = []
+        for borrowing in open_loans:
+            returned = dict(borrowing, return_date=return_date)
+            self.replace("borrowings", borrowing, returned)
+            self.loans.returned(returned)
+            borrowings.append(returned)
+        self.mark_changed("borrowings")
+        try:
+            self.save_borrowings()
+        except OSError:
+            # Nothing was written, so none of the returns are kept.
+            for borrowing, returned in zip(open_loans, borrowings):
+                self.replace("borrowings", returned, borrowing)
+            self.index_borrowings()
+            raise
+        for borrowing in borrowings:
+            self.events.publish("return_item", "borrowings", borrowing["borrowing_id"], borrowing_record(borrowing))
+
+        # The next members waiting for the items can now borrow them, once no one else has them on loan.
+        promoted = []
+        for borrowing in borrowings:
+            if self.loans.is_borrowed(borrowing["item_id"]):
+                continue
+            hold = self.holds.promote(borrowing["item_id"])
+            if hold is not None:
+                promoted.append(hold)
+        if promoted:
+            self.mark_changed("holds")
+            self.save_holds()
+        for hold in promoted:
+            self.events.publish("return_item", "holds", hold.hold_id, hold_record(hold))
 
         return True
 
-    def return_item(self, borrowing_id):
-        for borrowing in self.borrowings:
-            if borrowing["borrowing_id"] == borrowing_id:
-                borrowing["return_date"] = datetime.date.today()
-                self.save_borrowings()
-                break
+    @instrument("place_hold")
+    @exclusive
+    def place_hold(self, item_id, member_id):
+        # The item should exist and the member should not already hold it.
+        if not self.find_item(item_id):
+            return False
+
+        hold = self.holds.place(item_id, member_id)
+        if hold is None:
+            return False
+        # An item on the shelf which nobody else holds can be borrowed right away.
+        if not self.loans.is_borrowed(item_id) and self.holds.count(item_id) == 1:
+            self.holds.promote(item_id)
+        self.mark_changed("holds")
+        self.save_holds()
+        self.events.publish("place_hold", "holds", hold.hold_id, hold_record(hold))
+
+        return True
+
+    @instrument("cancel_hold")
+    @exclusive
+    def cancel_hold(self, hold_id, member_id=None):
+        # The hold should exist and belong to the member (if given).
+        hold = self.holds.cancel(hold_id, member_id)
+        if hold is None:
+            return False
+        # The item of a ready hold is waiting on the shelf: it goes to the next member in line.
+        promoted = None
+        if hold.status == READY:
+            promoted = self.holds.promote(hold.item_id)
+        self.mark_changed("holds")
+        self.save_holds()
+        self.events.publish("cancel_hold", "holds", hold_id)
+        if promoted is not None:
+            self.events.publish("cancel_hold", "holds", promoted.hold_id, hold_record(promoted))
+
+        return True
 
 
 class LibraryMenuIterface(LibraryManagementSystem):
@@ -446,7 +1027,7 @@ class LibraryMenuIterface(LibraryManagementSystem):
 
     def __init__(self, level=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.load_data()
+        # Nothing is loaded up front: each menu loads the collections it uses when it first accesses them.
         self.user_login()
 
     def exit_option(self):
@@ -488,6 +1069,19 @@ class LibraryMenuIterface(LibraryManagementSystem):
                 break
         return user_input
 
+    def validate_id_list_input(self, prompt):
+        """
+        Validates a comma separated list of IDs. Returns the IDs.
+        """
+        while True:
+            ids = [value.strip() for value in self.validate_string_input(prompt).split(",") if value.strip()]
+            if len(ids) == 0:
+                print("")
+                print("This value can not be empty")
+            else:
+                break
+        return ids
+
     def validate_email(self):
         """
         Validates member email to be a valid one. Returns the valid email.
@@ -572,7 +1166,6 @@ class LibraryMenuIterface(LibraryManagementSystem):
         Displays all libraries present allowing members to choose.
         If active user is an admin, they can create a library
         """
-        libary_count = len(self.libraries)
         print("")
         if self.is_admin:
             print("00. Add a library")
@@ -584,11 +1177,7 @@ class LibraryMenuIterface(LibraryManagementSystem):
         print(f"01. Go back to the {display} menu")
         print("02. Exit program")
         print("")
-        if libary_count == 0:
-            print("Sorry, there are no libraries available yet. An admin can add them")
-        else:
-            for library in self.libraries:
-                print(library)
+        write(self.render_libraries())
 
         user_option = self.validate_string_input(
             "Enter your option here. (In case of a library, enter the library ID) "
@@ -639,9 +1228,12 @@ class LibraryMenuIterface(LibraryManagementSystem):
         if self.is_admin:
             print("6. Edit library")
             print("7. Delete library. (WARNING: It deletes all items related to a library. Borrowing are retained.)")
+            print("8. Show metrics report")
+            print("9. Export items and borrowings of the library")
+            print("10. Overdue items")
 
         if self.is_admin:
-            self.validate_number_input(0, 8)
+            self.validate_number_input(0, 11)
         else:
             self.validate_number_input(0, 6)
 
@@ -670,13 +1262,91 @@ class LibraryMenuIterface(LibraryManagementSystem):
             else:
                 print("Operation was not successful. Please try again")
             self.library_operations_menu()
-        else:
+        elif self.user_choice == 7:
             is_succeessful = self.delete_library(self.current_library_ID)
             if is_succeessful:
                 print("Operation was successful")
             else:
                 print("Operation was not successful. Please try again")
             self.library_menu()
+        elif self.user_choice == 8:
+            self.metrics_menu()
+            self.library_operations_menu()
+        elif self.user_choice == 9:
+            self.export_menu()
+            self.library_operations_menu()
+        else:
+            self.overdue_menu()
+            self.library_operations_menu()
+
+    def metrics_menu(self):
+        """
+        Displays the operation metrics collected in this session. Allows an admin to write them to a file.
+        """
+        print("")
+        if not metrics.enabled:
+            print("Metrics are disabled. Start the program with --metrics to collect them.")
+            return
+        print(metrics.text_report())
+        print("")
+        print("What would you like to do?")
+        print("1. Go back")
+        print("2. Save the report to a file (use a .prom extension for the Prometheus format)")
+
+        self.validate_number_input(1, 3)
+
+        if self.user_choice == 2:
+            path = self.validate_string_input("Enter the path of the report file: ")
+            try:
+                metrics.dump(path)
+                print("Operation was successful")
+            except OSError:
+                print("Operation was not successful. The file could not be written.")
+
+    def export_menu(self):
+        """
+        Allows an admin to export the items or borrowings of the current library to a CSV or JSON Lines file.
+        """
+        print("")
+        print("What would you like to export?")
+        print("1. Items")
+        print("2. Borrowings")
+
+        self.validate_number_input(1, 3)
+        kind = "items" if self.user_choice == 1 else "borrowings"
+
+        print("")
+        print("Which format?")
+        for number, fmt in enumerate(FORMATS, start=1):
+            print(f"{number}. {fmt}")
+
+        self.validate_number_input(1, len(FORMATS) + 1)
+        fmt = FORMATS[self.user_choice - 1]
+
+        path = self.validate_string_input("Enter the path of the export file (add .gz to compress it): ")
+        try:
+            count = export(self, kind, path, fmt, library_id=self.current_library_ID)
+            print(f"Operation was successful. Exported {count} {kind}.")
+        except OSError:
+            print("Operation was not successful. The file could not be written.")
+
+    def overdue_menu(self):
+        """
+        Displays the items of the current library which are borrowed past their due date.
+        """
+        today = datetime.date.today()
+        overdue = self.overdue_borrowings(self.current_library_ID, today)
+        print("")
+        print("Overdue Items")
+        if len(overdue) == 0:
+            print("There are no overdue items")
+        for borrowing in overdue:
+            due_date = self.loans.due_date(borrowing["borrowing_id"])
+            print(
+                f"Borrowing ID: {borrowing['borrowing_id']} Item ID: {borrowing['item_id']} Member ID: "
+                f"{borrowing['member_id']} Borrowing date: {borrowing['borrow_date']} Due date: {due_date} "
+                f"({(today - due_date).days} days overdue)"
+            )
 
     def books_menu(self):
         """
@@ -699,9 +1369,7 @@ class LibraryMenuIterface(LibraryManagementSystem):
         else:
             self.validate_number_input(0, 4)
 
-        library_books = [
-            book for book in self.items if (book.item_type == "Book" and book.library_id == self.current_library_ID)
-        ]
+        library_books = self.catalogue.where(library_id=self.current_library_ID, item_type="Book").all()
 
         print("")
         if self.user_choice == 0:
@@ -709,29 +1377,24 @@ class LibraryMenuIterface(LibraryManagementSystem):
         elif self.user_choice == 1:
             self.exit_option()
         elif self.user_choice == 2:
-            if len(library_books) == 0:
-                print("There are no items to display")
-            for book in library_books:
-                print(book)
+            write(self.render_items(self.current_library_ID, "Book"))
             self.books_menu()
         elif self.user_choice == 3:
             if self.is_admin:
                 print("Sorry, you have to log in as a member to borrow.")
             else:
-                itemid = self.validate_string_input("Enter the Item ID of the book: ")
-                match = False
-                for book in library_books:
-                    if book.item_id == itemid:
-                        match = True
-                        break
-                if not match:
+                itemids = self.validate_id_list_input(
+                    "Enter the Item ID of the book (separate several IDs with commas): "
+                )
+                library_ids = {book.item_id for book in library_books}
+                if not all(itemid in library_ids for itemid in itemids):
                     print("Sorry, such a book does not exist")
                 else:
-                    is_success = self.borrow_item(itemid, self.current_member_id)
+                    is_success = self.borrow_items(itemids, self.current_member_id)
                     if is_success:
                         print("Operation was successful")
                     else:
-                        print("Operation was not successful. You have to return the item first.")
+                        print("Operation was not successful. The items are on loan or kept for another member's hold.")
             self.books_menu()
         elif self.user_choice == 4:
             bookid = self.validate_string_input("What is the book ID? ")
@@ -799,11 +1462,7 @@ class LibraryMenuIterface(LibraryManagementSystem):
         else:
             self.validate_number_input(0, 4)
 
-        library_article = [
-            article
-            for article in self.items
-            if (article.item_type == "Article" and article.library_id == self.current_library_ID)
-        ]
+        library_article = self.catalogue.where(library_id=self.current_library_ID, item_type="Article").all()
 
         print("")
         if self.user_choice == 0:
@@ -811,29 +1470,24 @@ class LibraryMenuIterface(LibraryManagementSystem):
         elif self.user_choice == 1:
             self.exit_option()
         elif self.user_choice == 2:
-            if len(library_article) == 0:
-                print("There are no items to display")
-            for article in library_article:
-                print(article)
+            write(self.render_items(self.current_library_ID, "Article"))
             self.articles_menu()
         elif self.user_choice == 3:
             if self.is_admin:
                 print("Sorry, you have to log in as a member to borrow.")
             else:
-                itemid = self.validate_string_input("Enter the Item ID of the article: ")
-                match = False
-                for article in library_article:
-                    if article.item_id == itemid:
-                        match = True
-                        break
-                if not match:
+                itemids = self.validate_id_list_input(
+                    "Enter the Item ID of the article (separate several IDs with commas): "
+                )
+                library_ids = {article.item_id for article in library_article}
+                if not all(itemid in library_ids for itemid in itemids):
                     print("Sorry, such a article does not exist")
                 else:
-                    is_success = self.borrow_item(itemid, self.current_member_id)
+                    is_success = self.borrow_items(itemids, self.current_member_id)
                     if is_success:
                         print("Operation was successful")
                     else:
-                        print("Operation was not successful. You have to return the item first.")
+                        print("Operation was not successful. The items are on loan or kept for another member's hold.")
             self.articles_menu()
         elif self.user_choice == 4:
             articleid = self.validate_string_input("What is the article ID? ")
@@ -905,11 +1559,7 @@ class LibraryMenuIterface(LibraryManagementSystem):
         else:
             self.validate_number_input(0, 3)
 
-        library_media = [
-            media
-            for media in self.items
-            if (media.item_type == "Digital Media" and media.library_id == self.current_library_ID)
-        ]
+        library_media = self.catalogue.where(library_id=self.current_library_ID, item_type="Digital Media").all()
 
         print("")
         if self.user_choice == 0:
@@ -917,29 +1567,24 @@ class LibraryMenuIterface(LibraryManagementSystem):
         elif self.user_choice == 1:
             self.exit_option()
         elif self.user_choice == 2:
-            if len(library_media) == 0:
-                print("There are no items to display")
-            for media in library_media:
-                print(media)
+            write(self.render_items(self.current_library_ID, "Digital Media"))
             self.digital_media_menu()
         elif self.user_choice == 3:
             if self.is_admin:
                 print("Sorry, you have to log in as a member to borrow.")
             else:
-                itemid = self.validate_string_input("Enter the Item ID of the media: ")
-                match = False
-                for media in library_media:
-                    if media.item_id == itemid:
-                        match = True
-                        break
-                if not match:
+                itemids = self.validate_id_list_input(
+                    "Enter the Item ID of the media (separate several IDs with commas): "
+                )
+                library_ids = {media.item_id for media in library_media}
+                if not all(itemid in library_ids for itemid in itemids):
                     print("Sorry, such a media does not exist")
                 else:
-                    is_success = self.borrow_item(itemid, self.current_member_id)
+                    is_success = self.borrow_items(itemids, self.current_member_id)
                     if is_success:
                         print("Operation was successful")
                     else:
-                        print("Operation was not successful. You have to return the item first.")
+                        print("Operation was not successful. The items are on loan or kept for another member's hold.")
             self.digital_media_menu()
 
         elif self.user_choice == 4:
@@ -997,12 +1642,10 @@ class LibraryMenuIterface(LibraryManagementSystem):
 
     def member_borrwowings_menu(self):
         """
-        Display all the borrowings made by a particular member.
-        Allows a member to return items to which they have borrowed.
+        Display all the borrowings and holds made by a particular member.
+        Allows a member to return items to which they have borrowed and to place or cancel holds on items.
         """
-        member_borrowings = [
-            transaction for transaction in self.borrowings if transaction["member_id"] == self.current_member_id
-        ]
+        member_borrowings = self.ledger.where(member_id=self.current_member_id).all()
         complete_member_borrowings = [
             transaction for transaction in member_borrowings if transaction["return_date"] is not None
         ]
@@ -1014,6 +1657,8 @@ class LibraryMenuIterface(LibraryManagementSystem):
         if len(uncomplete_member_borrowings) == 0:
             print("You have no uncompleted borrowings")
         else:
+            # Due dates are not shown: they depend on the item types, and a member returning an item should not have
+            # to wait for the whole catalogue to load. Overdue reminders tell members when their loans were due.
             for uncompleted in uncomplete_member_borrowings:
                 print(
                     f"Borrowing ID: {uncompleted['borrowing_id']} Item ID: {uncompleted['item_id']} Borrowing date: "
@@ -1028,34 +1673,56 @@ class LibraryMenuIterface(LibraryManagementSystem):
                     f"Borrowing ID: {completed['borrowing_id']} Item ID: {completed['item_id']} Borrowing date: "
                     f"{completed['borrow_date']} Return Date: {completed['return_date']}"
                 )
+        print("Holds")
+        member_holds = self.holds.for_member(self.current_member_id)
+        if len(member_holds) == 0:
+            print("You have no holds")
+        else:
+            for hold in member_holds:
+                if hold.status == READY:
+                    print(f"{hold} (Ready to borrow)")
+                else:
+                    print(f"{hold} Position in queue: {self.holds.position(hold)}")
 
         print("")
         print("What would you like to do?")
         print("1. Go back")
         print("2. Exit program")
+        print("3. Place a hold on an item")
+        print("4. Cancel a hold")
         # Ensure a member has unreturned books first
         if len(uncomplete_member_borrowings) != 0:
-            print("3. Return an item")
+            print("5. Return an item")
 
-            self.validate_number_input(1, 4)
+            self.validate_number_input(1, 6)
         else:
             print("Currently, you have no items to return.")
-            self.validate_number_input(1, 3)
+            self.validate_number_input(1, 5)
 
         if self.user_choice == 1:
             self.library_operations_menu()
         elif self.user_choice == 2:
             self.exit_option()
+        elif self.user_choice == 3:
+            itemid = self.validate_string_input("Enter the Item ID to hold: ")
+            is_succeessful = self.place_hold(itemid, self.current_member_id)
+            if is_succeessful:
+                print("Operation was successful")
+            else:
+                print("Operation was not successful. The item does not exist or you already hold it.")
+            self.member_borrwowings_menu()
+        elif self.user_choice == 4:
+            holdid = self.validate_string_input("Enter the hold ID: ")
+            is_succeessful = self.cancel_hold(holdid, self.current_member_id)
+            if is_succeessful:
+                print("Operation was successful")
+            else:
+                print("Please enter a valid hold ID")
+            self.member_borrwowings_menu()
         else:
-            borrowing_id = self.validate_string_input("Enter the borrowing ID: ")
-            # Ensure the borrowing ID is valid for the member and the item is unreturned
-            match = False
-            for uncompleted in uncomplete_member_borrowings:
-                if uncompleted["borrowing_id"] == borrowing_id:
-                    match = True
-                    break
-            if not match:
+            borrowing_ids = self.validate_id_list_input("Enter the borrowing ID (separate several IDs with commas): ")
+            # Ensure the borrowing IDs are valid for the member and the items are unreturned
+            is_success = self.return_items(borrowing_ids, self.current_member_id)
+            if not is_success:
                 print("Please enter a valid borrowing ID")
-            else:
-                self.return_item(borrowing_id)
             self.member_borrwowings_menu()
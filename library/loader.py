@@ -0,0 +1,93 @@
+"""
+Parallel loading of the data files.
+
+The data files are parsed concurrently in threads. A file larger than the chunking threshold is split into byte
+ranges which end on line boundaries; the ranges are parsed in a process pool and merged back in file order.
+Lines are decoded with the codec matching the file's format (see library.codec).
+"""
+
+import concurrent.futures
+import locale
+import os
+
+from library.codec import data_offset
+
+# Files at least this large are split into chunks and parsed in worker processes.
+CHUNK_THRESHOLD = 4 * 1024 * 1024
+# Smallest chunk a file is split into.
+MINIMUM_CHUNK_SIZE = 1024 * 1024
+
+
+def chunk_ranges(path, chunk_size, start=0):
+    """
+    Splits a file from the start offset into (start, end) byte ranges of about chunk_size bytes.
+    Every range ends just after a newline (or at the end of the file) so that no line is split.
+    """
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, "rb") as file:
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                file.seek(end)
+                # Move the end of the range to the end of the line it falls in.
+                file.readline()
+                end = file.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_range(path, start, end, parse_record, decode):
+    """
+    Decodes and parses the lines of a byte range of a file. Runs in a worker process for chunked files.
+    """
+    with open(path, "rb") as file:
+        file.seek(start)
+        text = file.read(end - start).decode(locale.getpreferredencoding(False))
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+    lines = text.split("\n")
+    # The range ends with a line break, leaving an empty string at the end.
+    if lines[-1] == "":
+        lines.pop()
+    return [parse_record(decode(line)) for line in lines]
+
+
+def parse_file(path, parse_record, process_pool, workers):
+    """
+    Parses a whole file, splitting it across the process pool if it is above the chunking threshold.
+    """
+    size = os.path.getsize(path)
+    decode, offset = data_offset(path)
+    if size < CHUNK_THRESHOLD:
+        return parse_range(path, offset, size, parse_record, decode)
+
+    chunk_size = max(MINIMUM_CHUNK_SIZE, -(-size // workers))
+    futures = [
+        process_pool.submit(parse_range, path, start, end, parse_record, decode)
+        for start, end in chunk_ranges(path, chunk_size, offset)
+    ]
+    records = []
+    for future in futures:
+        records.extend(future.result())
+    return records
+
+
+def load_files_parallel(files, workers=None):
+    """
+    Parses several files concurrently.
+    `files` maps a name to a (path, parse_record) pair, where parse_record is a module level function turning the
+    decoded fields of a line into a record.
+    Returns a dictionary mapping each name to the list of its records in file order.
+    """
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as process_pool:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(files)) as thread_pool:
+            futures = {
+                name: thread_pool.submit(parse_file, path, parse_record, process_pool, workers)
+                for name, (path, parse_record) in files.items()
+            }
+            return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,177 @@
+"""
+Date indexes over the borrowings (loans) of the Library Management System.
+
+Each open loan is due a number of days after it was borrowed, depending on the type of the borrowed item. Due dates
+are only computed when first asked for, so that borrowing and returning do not need the items to be loaded.
+The LoanIndex keeps:
+    - A heap of the due dates of open loans, so that overdue loans are found without scanning every borrowing.
+    - Sorted lists of borrowing and return dates which can be bisected for date range queries.
+It also indexes borrowings by ID and by member and open loans by (item, member), and tracks the highest borrowing ID.
+"""
+
+import bisect
+import datetime
+import heapq
+
+# Number of days an item of each type can be borrowed for.
+LOAN_PERIODS = {"Book": 21, "Article": 14, "Digital Media": 7}
+# Used for items whose type is unknown (e.g. deleted items).
+DEFAULT_LOAN_PERIOD = 21
+
+
+class LoanIndex:
+    """
+    Indexes borrowings by their due, borrowing and return dates.
+    Borrowings are the dictionaries of LibraryManagementSystem.borrowings.
+    """
+
+    def __init__(self, loan_periods=None):
+        self.loan_periods = dict(LOAN_PERIODS)
+        if loan_periods:
+            self.loan_periods.update(loan_periods)
+        # Maps an item ID to its type (or None if the item is unknown)
+        self.item_type_of = None
+        self.clear()
+
+    def clear(self):
+        # Borrowing ID -> borrowing
+        self.borrowings = {}
+        # Member ID -> {Borrowing ID -> borrowing}
+        self.member_borrowings = {}
+        # (Item ID, Member ID) -> open borrowing
+        self.open_loans = {}
+        # Item ID -> number of open loans of the item
+        self.item_loans = {}
+        self.last_borrowing_id = 0
+        # Borrowing ID -> due date of the open loans, or None until a due date is asked for
+        self.due_dates = None
+        # Heap of (due date, borrowing ID). Entries of returned loans are skipped and removed lazily.
+        self.due_heap = []
+        # Sorted (date, borrowing ID) pairs
+        self.borrow_dates = []
+        self.return_dates = []
+
+    def loan_period(self, item_type):
+        return self.loan_periods.get(item_type, DEFAULT_LOAN_PERIOD)
+
+    def build(self, borrowings, item_type_of):
+        """
+        Rebuilds the indexes. item_type_of maps an item ID to its type (or None if the item is unknown); it is only
+        called once due dates are needed.
+        """
+        self.clear()
+        self.item_type_of = item_type_of
+        for borrowing in borrowings:
+            borrowing_id = borrowing["borrowing_id"]
+            self.borrowings[borrowing_id] = borrowing
+            self.member_borrowings.setdefault(borrowing["member_id"], {})[borrowing_id] = borrowing
+            self.last_borrowing_id = max(self.last_borrowing_id, int(borrowing_id))
+            self.borrow_dates.append((borrowing["borrow_date"], borrowing_id))
+            if borrowing["return_date"] is None:
+                self.open_loans[(borrowing["item_id"], borrowing["member_id"])] = borrowing
+                self.item_loans[borrowing["item_id"]] = self.item_loans.get(borrowing["item_id"], 0) + 1
+            else:
+                self.return_dates.append((borrowing["return_date"], borrowing_id))
+        self.borrow_dates.sort()
+        self.return_dates.sort()
+
+    def index_due_dates(self):
+        # Computes the due dates of the open loans the first time they are needed.
+        if self.due_dates is not None:
+            return
+        self.due_dates = {}
+        for borrowing in self.open_loans.values():
+            self.due_dates[borrowing["borrowing_id"]] = self.due_date_of(borrowing)
+        self.due_heap = [(due_date, borrowing_id) for borrowing_id, due_date in self.due_dates.items()]
+        heapq.heapify(self.due_heap)
+
+    def due_date_of(self, borrowing):
+        item_type = self.item_type_of(borrowing["item_id"]) if self.item_type_of is not None else None
+        return borrowing["borrow_date"] + datetime.timedelta(days=self.loan_period(item_type))
+
+    def add(self, borrowing):
+        """
+        Indexes a new open loan.
+        """
+        borrowing_id = borrowing["borrowing_id"]
+        self.borrowings[borrowing_id] = borrowing
+        self.member_borrowings.setdefault(borrowing["member_id"], {})[borrowing_id] = borrowing
+        self.last_borrowing_id = max(self.last_borrowing_id, int(borrowing_id))
+        self.open_loans[(borrowing["item_id"], borrowing["member_id"])] = borrowing
+        self.item_loans[borrowing["item_id"]] = self.item_loans.get(borrowing["item_id"], 0) + 1
+        # New loans are borrowed today, so insort is an append in practice.
+        bisect.insort(self.borrow_dates, (borrowing["borrow_date"], borrowing_id))
+        if self.due_dates is not None:
+            due_date = self.due_date_of(borrowing)
+            self.due_dates[borrowing_id] = due_date
+            heapq.heappush(self.due_heap, (due_date, borrowing_id))
+
+    def returned(self, borrowing):
+        """
+        Records the return of a loan. borrowing is the returned copy of the open loan, which it replaces in the
+        indexes. Its heap entry is left behind and skipped from then on.
+        """
+        borrowing_id = borrowing["borrowing_id"]
+        self.borrowings[borrowing_id] = borrowing
+        self.member_borrowings[borrowing["member_id"]][borrowing_id] = borrowing
+        if self.open_loans.pop((borrowing["item_id"], borrowing["member_id"]), None) is not None:
+            item_id = borrowing["item_id"]
+            self.item_loans[item_id] -= 1
+            if not self.item_loans[item_id]:
+                del self.item_loans[item_id]
+        bisect.insort(self.return_dates, (borrowing["return_date"], borrowing_id))
+        if self.due_dates is None:
+            return
+        self.due_dates.pop(borrowing_id, None)
+        # Compact the heap once most of its entries belong to returned loans.
+        if len(self.due_heap) > 2 * len(self.due_dates) + 16:
+            self.due_heap = [(due_date, borrowing_id) for borrowing_id, due_date in self.due_dates.items()]
+            heapq.heapify(self.due_heap)
+
+    def is_borrowed(self, item_id):
+        return item_id in self.item_loans
+
+    def due_date(self, borrowing_id):
+        self.index_due_dates()
+        return self.due_dates.get(borrowing_id)
+
+    def overdue(self, today=None):
+        """
+        Returns the open loans due before today, most overdue first.
+        Only the part of the heap holding overdue entries is visited: O(k log k) for k overdue loans.
+        """
+        today = today or datetime.date.today()
+        self.index_due_dates()
+        heap = self.due_heap
+        overdue = []
+        candidates = [(heap[0], 0)] if heap else []
+        while candidates:
+            (due_date, borrowing_id), position = heapq.heappop(candidates)
+            if due_date >= today:
+                # Every entry below this one in the heap is due later.
+                continue
+            if self.due_dates.get(borrowing_id) == due_date:
+                overdue.append(self.borrowings[borrowing_id])
+            for child in (2 * position + 1, 2 * position + 2):
+                if child < len(heap):
+                    heapq.heappush(candidates, (heap[child], child))
+        return overdue
+
+    def borrowed_between(self, start, end):
+        """
+        Yields the borrowings borrowed from start to end (inclusive), in date order. Either bound may be None.
+        """
+        return self.between(self.borrow_dates, start, end)
+
+    def returned_between(self, start, end):
+        """
+        Yields the borrowings returned from start to end (inclusive), in date order. Either bound may be None.
+        """
+        return self.between(self.return_dates, start, end)
+
+    def between(self, dates, start, end):
+        low = bisect.bisect_left(dates, (start,)) if start is not None else 0
+        high = bisect.bisect_left(dates, (end + datetime.timedelta(days=1),)) if end is not None else len(dates)
+        # Walks the positions of the range rather than slicing it, so that exporting a long range keeps constant memory.
+        for position in range(low, high):
+            yield self.borrowings[dates[position][1]]
@@ -0,0 +1,172 @@
+"""
+Operation timing and metrics instrumentation for the Library Management System.
+
+Methods of LibraryManagementSystem are wrapped with the `instrument` decorator. While metrics are disabled (the
+default) the wrapper only checks a flag before calling through. Once enabled, it records per-operation counts,
+latency histograms, the number of records scanned and the number of bytes written.
+The collected metrics can be dumped as a text report or a Prometheus exposition file.
+"""
+
+import atexit
+import functools
+import time
+
+# Upper bounds (in seconds) of the latency histogram buckets. The last bucket is unbounded.
+LATENCY_BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float("inf")]
+
+
+class OperationMetrics:
+    """
+    The metrics collected for a single operation.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.records_scanned = 0
+        self.bytes_written = 0
+
+    def observe_latency(self, seconds):
+        self.count += 1
+        self.total_time += seconds
+        if seconds > self.max_time:
+            self.max_time = seconds
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+
+
+class Metrics:
+    """
+    A registry of operation metrics. It is disabled by default.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.operations = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.operations = {}
+
+    def operation(self, name):
+        if name not in self.operations:
+            self.operations[name] = OperationMetrics()
+        return self.operations[name]
+
+    def observe_latency(self, name, seconds, failed=False):
+        operation = self.operation(name)
+        operation.observe_latency(seconds)
+        if failed:
+            operation.errors += 1
+
+    def observe_scanned(self, name, records):
+        if self.enabled:
+            self.operation(name).records_scanned += records
+
+    def observe_bytes(self, name, size):
+        if self.enabled:
+            self.operation(name).bytes_written += size
+
+    def text_report(self):
+        """
+        Returns a human readable report of the collected metrics.
+        """
+        if not self.operations:
+            return "No operations have been recorded."
+
+        header = (
+            f"{'Operation':<28}{'Count':>8}{'Errors':>8}{'Mean (ms)':>12}{'Max (ms)':>12}{'Scanned':>12}"
+            f"{'Bytes':>14}"
+        )
+        lines = [header, "-" * len(header)]
+        for name in sorted(self.operations):
+            operation = self.operations[name]
+            mean = operation.total_time / operation.count * 1000 if operation.count else 0.0
+            lines.append(
+                f"{name:<28}{operation.count:>8}{operation.errors:>8}{mean:>12.3f}{operation.max_time * 1000:>12.3f}"
+                f"{operation.records_scanned:>12}{operation.bytes_written:>14}"
+            )
+        return "\n".join(lines)
+
+    def prometheus_report(self):
+        """
+        Returns the collected metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP lms_operation_seconds Latency of LibraryManagementSystem operations.",
+            "# TYPE lms_operation_seconds histogram",
+        ]
+        for name in sorted(self.operations):
+            operation = self.operations[name]
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, operation.buckets):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'lms_operation_seconds_bucket{{operation="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'lms_operation_seconds_sum{{operation="{name}"}} {operation.total_time}')
+            lines.append(f'lms_operation_seconds_count{{operation="{name}"}} {operation.count}')
+
+        for metric, attribute, description in [
+            ("lms_operation_errors_total", "errors", "Operations that raised an exception."),
+            ("lms_records_scanned_total", "records_scanned", "Records scanned by operations."),
+            ("lms_bytes_written_total", "bytes_written", "Bytes written to the data files by operations."),
+        ]:
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} counter")
+            for name in sorted(self.operations):
+                lines.append(f'{metric}{{operation="{name}"}} {getattr(self.operations[name], attribute)}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """
+        Writes the metrics to a file. Files ending in '.prom' use the Prometheus format, others the text report.
+        """
+        with open(path, "w") as file:
+            if path.endswith(".prom"):
+                file.write(self.prometheus_report())
+            else:
+                file.write(self.text_report() + "\n")
+
+    def dump_on_exit(self, path):
+        atexit.register(self.dump, path)
+
+
+# The metrics registry shared by all instrumented operations.
+metrics = Metrics()
+
+
+def instrument(name):
+    """
+    Decorator recording the latency of an operation under the given name while metrics are enabled.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                metrics.observe_latency(name, time.perf_counter() - start, failed)
+
+        # Lets the profiler find the instrumented operations.
+        wrapper.operation = name
+        return wrapper
+
+    return decorator
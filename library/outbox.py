@@ -0,0 +1,727 @@
+"""
+Email notifications to members, queued in a persistent outbox and delivered in batches by a background worker.
+
+Notifications (overdue loans, holds ready to borrow) are appended to an outbox journal, a JSON Lines file where each
+line records a notification being queued, claimed by a worker, sent, rescheduled or given up on. Queuing is a single
+append, so the desk never waits for the mail server. The journal is replayed when the outbox is opened; notifications
+which were not sent are delivered then. Several processes (e.g. main.py --notify and queue-overdue run from cron) can
+share the journal: each reads the entries the others appended before writing its own, and the workers pick up the
+notifications queued by the other processes.
+
+The OutboxWorker thread takes the notifications which are due in batches and sends them over one SMTP connection
+which is kept open between batches. A failed notification is retried with exponential backoff until it has been
+attempted max_attempts times. Notifications are deduplicated per member, kind and day: e.g. a member gets at most
+one overdue reminder a day however often the overdue loans are queued. Holds are notified once per hold.
+
+Usage:
+    python main.py --notify --smtp-host localhost --smtp-port 1025
+    python -m library.outbox queue-overdue --data-dir data
+    python -m library.outbox send --smtp-host localhost --smtp-port 1025
+    python -m library.outbox status --data-dir data
+    python -m library.outbox debug-server --port 1025
+"""
+
+import argparse
+import datetime
+import email.message
+import fcntl
+import json
+import os
+import smtplib
+import socketserver
+import threading
+import time
+
+from library.holds import READY
+from library.metrics import metrics
+
+OVERDUE = "overdue"
+HOLD_READY = "hold_ready"
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class Notification:
+    """
+    An email to a member. The key identifies it for deduplication.
+    """
+
+    def __init__(
+        self,
+        notification_id,
+        member_id,
+        email,
+        kind,
+        subject,
+        body,
+        key,
+        created=None,
+        attempts=0,
+        next_attempt=0.0,
+        status=PENDING,
+    ):
+        self.notification_id = notification_id
+        self.member_id = member_id
+        self.email = email
+        self.kind = kind
+        self.subject = subject
+        self.body = body
+        self.key = key
+        self.created = created or datetime.datetime.now().isoformat(timespec="seconds")
+        self.attempts = attempts
+        # Time (as returned by time.time) before which the notification is not sent again.
+        self.next_attempt = next_attempt
+        # Time before which the notification is left to the worker which took it (see Outbox.due).
+        self.claimed_until = 0.0
+        self.status = status
+
+    def __str__(self):
+        return f"#{self.notification_id} {self.status} {self.kind} to {self.email} ({self.attempts} attempts)"
+
+    def to_dict(self):
+        return {
+            "notification_id": self.notification_id,
+            "member_id": self.member_id,
+            "email": self.email,
+            "kind": self.kind,
+            "subject": self.subject,
+            "body": self.body,
+            "key": self.key,
+            "created": self.created,
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(
+            values["notification_id"],
+            values["member_id"],
+            values["email"],
+            values["kind"],
+            values["subject"],
+            values["body"],
+            values["key"],
+            values["created"],
+        )
+
+
+class OutboxStats:
+    """
+    Delivery counters of an outbox, for throughput reporting.
+    """
+
+    def __init__(self):
+        self.queued = 0
+        self.duplicates = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+        self.send_time = 0.0
+
+    def __str__(self):
+        rate = self.sent / self.send_time if self.send_time else 0.0
+        return (
+            f"Queued: {self.queued} Duplicates skipped: {self.duplicates} Sent: {self.sent} Retried: {self.retried} "
+            f"Failed: {self.failed} Batches: {self.batches} Throughput: {rate:.1f} messages/s"
+        )
+
+
+class Outbox:
+    """
+    A persistent queue of notifications backed by a journal file. It is safe to use from several threads and
+    processes: every write to the journal is made under an exclusive lock on a lock file, after reading the entries
+    the other processes appended since the last one, so notification IDs and deduplication keys are shared. Each open
+    outbox also holds a shared lock on a second lock file; the journal is only compacted when it is opened while
+    nobody else holds that lock.
+    """
+
+    def __init__(self, path, max_attempts=5, backoff=30.0, max_backoff=3600.0, claim_timeout=300.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        # Delay before the first retry, doubled for every further attempt up to max_backoff (in seconds).
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # Seconds for which notifications taken by a worker are left alone by the workers of other processes.
+        self.claim_timeout = claim_timeout
+        self.lock = threading.Lock()
+        # Set whenever notifications are queued, to wake up the worker.
+        self.available = threading.Event()
+        self.stats = OutboxStats()
+        # Notification ID -> pending Notification, oldest first
+        self.pending = {}
+        # Dedup keys of the notifications queued today
+        self.keys = set()
+        self.last_id = 0
+        self.file = None
+        # Byte offset of the end of the journal entries read so far.
+        self.position = 0
+        self.lock_file = None
+        self.open_file = None
+        self.open()
+
+    def journal_lock(self):
+        """
+        Returns a context manager holding the exclusive lock of the journal writers.
+        """
+        return FileLock(self.lock_file)
+
+    def open(self):
+        self.lock_file = open(self.path + ".lock", "a")
+        self.open_file = open(self.path + ".open", "a")
+        with self.journal_lock():
+            try:
+                # Only succeeds if no other process has the outbox open; it can not open it meanwhile since the
+                # journal lock is held.
+                fcntl.flock(self.open_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                alone = True
+            except BlockingIOError:
+                alone = False
+            notifications = {}
+            if os.path.exists(self.path):
+                with open(self.path, "rb") as file:
+                    self.position = self.replay_from(file, 0, notifications)
+            self.pending = {key: value for key, value in notifications.items() if value.status == PENDING}
+            # Only the notifications still pending or created today (for deduplication) are kept in the journal.
+            today = datetime.date.today().isoformat()
+            kept = [value for value in notifications.values() if value.status == PENDING or value.created[:10] == today]
+            self.keys = {notification.key for notification in kept}
+            if notifications:
+                self.last_id = max(notifications)
+            if alone:
+                # The claims were made by processes which have closed the outbox since.
+                for notification in self.pending.values():
+                    notification.claimed_until = 0.0
+                self.compact(kept)
+            fcntl.flock(self.open_file, fcntl.LOCK_SH)
+            self.file = open(self.path, "a")
+        if self.pending:
+            self.available.set()
+
+    def compact(self, kept):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as file:
+            for notification in kept:
+                file.write(json.dumps({"op": "queued", "notification": notification.to_dict()}) + "\n")
+                if notification.status != PENDING:
+                    file.write(json.dumps({"op": notification.status, "id": notification.notification_id}) + "\n")
+                elif notification.attempts:
+                    file.write(json.dumps(self.retry_entry(notification)) + "\n")
+        os.replace(temp_path, self.path)
+        self.position = os.path.getsize(self.path)
+
+    def replay_from(self, file, position, notifications):
+        """
+        Replays the complete entries of the journal from a byte offset. Returns the offset following the last one.
+        """
+        file.seek(position)
+        for line in file:
+            if not line.endswith(b"\n"):
+                # A partially written last line.
+                break
+            self.replay(json.loads(line), notifications)
+            position += len(line)
+        return position
+
+    def refresh(self):
+        """
+        Reads the entries appended to the journal by other processes. Called with both locks held.
+        """
+        if os.path.getsize(self.path) == self.position:
+            return
+        with open(self.path, "rb") as file:
+            self.position = self.replay_from(file, self.position, self.pending)
+        for notification_id, notification in list(self.pending.items()):
+            self.keys.add(notification.key)
+            self.last_id = max(self.last_id, notification_id)
+            if notification.status != PENDING:
+                del self.pending[notification_id]
+
+    def replay(self, entry, notifications):
+        if entry["op"] == "queued":
+            notification = Notification.from_dict(entry["notification"])
+            notifications[notification.notification_id] = notification
+            return
+        notification = notifications.get(entry["id"])
+        if notification is None:
+            return
+        if entry["op"] == "retry":
+            notification.attempts = entry["attempts"]
+            notification.next_attempt = entry["next_attempt"]
+            notification.claimed_until = 0.0
+        elif entry["op"] == "claimed":
+            notification.claimed_until = entry["until"]
+        else:
+            notification.status = entry["op"]
+
+    def retry_entry(self, notification, error=None):
+        return {
+            "op": "retry",
+            "id": notification.notification_id,
+            "attempts": notification.attempts,
+            "next_attempt": notification.next_attempt,
+            "error": error,
+        }
+
+    def write(self, *entries):
+        # Called with both locks held, after refresh, so the entries follow everything read so far.
+        self.file.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        self.file.flush()
+        self.position = os.fstat(self.file.fileno()).st_size
+
+    def enqueue(self, member_id, email, kind, subject, body, reference=None, today=None):
+        """
+        Queues a notification. Returns it, or None if the same notification was already queued today.
+        The key is made of the member, the kind, the day and the optional reference (e.g. a hold ID).
+        """
+        today = today or datetime.date.today()
+        key = f"{member_id}:{kind}:{today.isoformat()}"
+        if reference is not None:
+            key += f":{reference}"
+        with self.lock, self.journal_lock():
+            self.refresh()
+            if key in self.keys:
+                self.stats.duplicates += 1
+                return None
+            self.last_id += 1
+            notification = Notification(self.last_id, member_id, email, kind, subject, body, key)
+            self.write({"op": "queued", "notification": notification.to_dict()})
+            self.keys.add(key)
+            self.pending[notification.notification_id] = notification
+            self.stats.queued += 1
+        self.available.set()
+        return notification
+
+    def due(self, limit, now=None):
+        """
+        Takes up to `limit` pending notifications which can be sent now, oldest first, including those queued by other
+        processes. They are claimed for claim_timeout seconds so that the workers of other processes skip them.
+        """
+        now = now or time.time()
+        with self.lock, self.journal_lock():
+            self.refresh()
+            batch = []
+            for notification in self.pending.values():
+                if notification.next_attempt <= now and notification.claimed_until <= now:
+                    batch.append(notification)
+                    if len(batch) == limit:
+                        break
+            for notification in batch:
+                notification.claimed_until = now + self.claim_timeout
+            if batch:
+                self.write(
+                    *[
+                        {"op": "claimed", "id": notification.notification_id, "until": notification.claimed_until}
+                        for notification in batch
+                    ]
+                )
+            return batch
+
+    def next_due(self):
+        # Seconds until the next pending notification can be sent, or None if nothing is pending.
+        with self.lock:
+            if not self.pending:
+                return None
+            next_attempt = min(
+                max(notification.next_attempt, notification.claimed_until) for notification in self.pending.values()
+            )
+            return max(0.0, next_attempt - time.time())
+
+    def mark_sent(self, notification):
+        with self.lock, self.journal_lock():
+            self.refresh()
+            notification.status = SENT
+            self.pending.pop(notification.notification_id, None)
+            self.write({"op": SENT, "id": notification.notification_id})
+            self.stats.sent += 1
+
+    def mark_failed(self, notification, error, now=None):
+        """
+        Schedules another attempt of a notification which could not be sent, or gives up after max_attempts.
+        """
+        now = now or time.time()
+        with self.lock, self.journal_lock():
+            self.refresh()
+            notification.attempts += 1
+            notification.claimed_until = 0.0
+            if notification.attempts >= self.max_attempts:
+                notification.status = FAILED
+                self.pending.pop(notification.notification_id, None)
+                self.write({"op": FAILED, "id": notification.notification_id, "error": error})
+                self.stats.failed += 1
+                return
+            delay = min(self.max_backoff, self.backoff * 2 ** (notification.attempts - 1))
+            notification.next_attempt = now + delay
+            self.write(self.retry_entry(notification, error))
+            self.stats.retried += 1
+
+    def close(self):
+        for name in ("file", "open_file", "lock_file"):
+            file = getattr(self, name)
+            if file is not None:
+                # Closing the files releases their locks.
+                file.close()
+                setattr(self, name, None)
+
+
+class FileLock:
+    """
+    Holds an exclusive lock on an open file for the duration of a with block.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def __enter__(self):
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+
+
+class SMTPSender:
+    """
+    Sends notifications over an SMTP connection which is opened on first use and reused until it is closed or lost.
+    """
+
+    def __init__(
+        self,
+        host="localhost",
+        port=25,
+        sender="library@localhost",
+        username=None,
+        password=None,
+        starttls=False,
+        timeout=30,
+    ):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.connection = None
+
+    def connect(self):
+        connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        self.connection = connection
+
+    def message(self, notification):
+        message = email.message.EmailMessage()
+        message["From"] = self.sender
+        message["To"] = notification.email
+        message["Subject"] = notification.subject
+        message.set_content(notification.body)
+        return message
+
+    def send(self, notifications):
+        """
+        Sends a batch of notifications. Returns a list of (notification, error) pairs where error is None for the
+        notifications which were sent. If the connection is lost the rest of the batch fails and is retried later.
+        """
+        results = []
+        for index, notification in enumerate(notifications):
+            try:
+                if self.connection is None:
+                    self.connect()
+                self.connection.send_message(self.message(notification))
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as error:
+                # The server refused this message only.
+                results.append((notification, str(error)))
+                continue
+            except (smtplib.SMTPException, OSError) as error:
+                self.drop_connection()
+                results.extend((remaining, str(error)) for remaining in notifications[index:])
+                break
+            results.append((notification, None))
+        return results
+
+    def drop_connection(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except OSError:
+                pass
+            self.connection = None
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.connection = None
+
+
+class OutboxWorker:
+    """
+    Delivers the notifications of an outbox in batches from a background thread.
+    """
+
+    def __init__(self, outbox, sender, batch_size=50, poll_interval=5.0):
+        self.outbox = outbox
+        self.sender = sender
+        self.batch_size = batch_size
+        # Longest wait between two checks of the outbox.
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def run_once(self):
+        """
+        Sends one batch of due notifications. Returns the number of notifications in the batch.
+        """
+        batch = self.outbox.due(self.batch_size)
+        if not batch:
+            return 0
+        start = time.perf_counter()
+        results = self.sender.send(batch)
+        elapsed = time.perf_counter() - start
+        failures = 0
+        for notification, error in results:
+            if error is None:
+                self.outbox.mark_sent(notification)
+            else:
+                failures += 1
+                self.outbox.mark_failed(notification, error)
+        self.outbox.stats.batches += 1
+        self.outbox.stats.send_time += elapsed
+        if metrics.enabled:
+            metrics.observe_latency("outbox_send_batch", elapsed, failed=failures > 0)
+            metrics.observe_scanned("outbox_send_batch", len(batch))
+        return len(batch)
+
+    def drain(self):
+        # Sends batches until nothing is due.
+        while not self.stopping.is_set() and self.run_once():
+            pass
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.outbox.available.clear()
+            self.drain()
+            # Sleep until notifications are queued, a retry is due or the poll interval has passed.
+            wait = self.outbox.next_due()
+            wait = self.poll_interval if wait is None else min(wait, self.poll_interval)
+            self.outbox.available.wait(wait)
+        self.sender.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="outbox-worker", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.outbox.available.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+def queue_overdue(system, outbox, today=None):
+    """
+    Queues one reminder per member listing all their overdue loans. Returns the number of reminders queued.
+    """
+    today = today or datetime.date.today()
+    member_loans = {}
+    for borrowing in system.overdue_borrowings(today=today):
+        member_loans.setdefault(borrowing["member_id"], []).append(borrowing)
+
+    members = {member.member_id: member for member in system.members if member.member_id in member_loans}
+    queued = 0
+    for member_id, loans in member_loans.items():
+        member = members.get(member_id)
+        if member is None:
+            continue
+        lines = [f"Dear {member.first_name},", "", "The following items are overdue:"]
+        for borrowing in loans:
+            lines.append(f"  Item {borrowing['item_id']}, due on {system.loans.due_date(borrowing['borrowing_id'])}")
+        lines.extend(["", "Please return them as soon as possible."])
+        subject = f"{len(loans)} overdue item(s)"
+        if outbox.enqueue(member_id, member.email, OVERDUE, subject, "\n".join(lines), today=today) is not None:
+            queued += 1
+    return queued
+
+
+class HoldNotifier:
+    """
+    An event subscriber queuing a notification whenever a hold becomes ready to borrow.
+    Members are read from the data directory when first needed and read again after any member changes; since every
+    change is saved before it is published, the members file is always up to date.
+    """
+
+    def __init__(self, data_dir, outbox):
+        self.data_dir = data_dir
+        self.outbox = outbox
+        # Member ID -> Member, or None until needed
+        self.members = None
+
+    def find_member(self, member_id):
+        if self.members is None:
+            # Imported here since the library module is only needed to read the members.
+            from library.library import LibraryManagementSystem
+
+            system = LibraryManagementSystem(data_dir=self.data_dir)
+            self.members = {member.member_id: member for member in system.members}
+        return self.members.get(member_id)
+
+    def __call__(self, event):
+        if event.collection == "members":
+            self.members = None
+            return
+        if event.collection != "holds" or not event.data or event.data["status"] != READY:
+            return
+        member = self.find_member(event.data["member_id"])
+        if member is None:
+            return
+        body = (
+            f"Dear {member.first_name},\n\nItem {event.data['item_id']} you placed a hold on has been returned and is "
+            f"ready for you to borrow.\n"
+        )
+        self.outbox.enqueue(
+            member.member_id, member.email, HOLD_READY, "Your hold is ready", body, reference=event.data["hold_id"]
+        )
+
+
+class DebugSMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one connection of the DebugSMTPServer: accepts every message and hands it to the server.
+    """
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 Library debug SMTP server")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                self.reply("250 Hello")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command[command.find(":") + 1 :].strip(" <>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                for data_line in self.rfile:
+                    if data_line.rstrip(b"\r\n") == b".":
+                        break
+                    lines.append(data_line.decode())
+                self.server.received.append((recipients, "".join(lines)))
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                # RSET, NOOP and anything else.
+                self.reply("250 OK")
+
+
+class DebugSMTPServer(socketserver.ThreadingTCPServer):
+    """
+    A local stand-in for a mail server which keeps the messages it receives in `received` as (recipients, message)
+    pairs instead of delivering them. Used to try the outbox without a real mail server.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="localhost", port=1025):
+        super().__init__((host, port), DebugSMTPHandler)
+        self.received = []
+
+
+def add_smtp_arguments(parser):
+    parser.add_argument("--smtp-host", default="localhost", help="SMTP server host")
+    parser.add_argument("--smtp-port", type=int, default=25, help="SMTP server port")
+    parser.add_argument("--smtp-user", help="SMTP user name")
+    parser.add_argument("--smtp-password", help="SMTP password")
+    parser.add_argument("--smtp-starttls", action="store_true", help="Use STARTTLS")
+    parser.add_argument("--mail-from", default="library@localhost", help="Sender address of the notifications")
+
+
+def sender_from_arguments(args):
+    return SMTPSender(
+        args.smtp_host, args.smtp_port, args.mail_from, args.smtp_user, args.smtp_password, args.smtp_starttls
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Queue and send the email notifications of the library.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    queue_parser = subparsers.add_parser("queue-overdue", help="Queue a reminder for each member with overdue items")
+    send_parser = subparsers.add_parser("send", help="Send the queued notifications")
+    add_smtp_arguments(send_parser)
+    send_parser.add_argument("--batch-size", type=int, default=50, help="Notifications sent per batch")
+    send_parser.add_argument("--follow", action="store_true", help="Keep sending newly queued notifications")
+    status_parser = subparsers.add_parser("status", help="Show the pending notifications")
+    debug_parser = subparsers.add_parser("debug-server", help="Run a local SMTP server printing what it receives")
+    debug_parser.add_argument("--port", type=int, default=1025, help="Port to listen on")
+    for subparser in (queue_parser, send_parser, status_parser):
+        subparser.add_argument("--data-dir", default="data", help="Directory of the data files")
+        subparser.add_argument("--outbox", help="Outbox journal (default: outbox.jsonl in the data directory)")
+    args = parser.parse_args(argv)
+
+    if args.command == "debug-server":
+        server = DebugSMTPServer(port=args.port)
+        print(f"Listening on localhost:{args.port}")
+        received = server.received
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        try:
+            while True:
+                while received:
+                    recipients, message = received.pop(0)
+                    print(f"To {', '.join(recipients)}:\n{message}", flush=True)
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    outbox = Outbox(args.outbox or os.path.join(args.data_dir, "outbox.jsonl"))
+    try:
+        if args.command == "queue-overdue":
+            # Imported here since it is only needed to find the overdue loans.
+            from library.library import LibraryManagementSystem
+
+            queued = queue_overdue(LibraryManagementSystem(data_dir=args.data_dir), outbox)
+            print(f"Queued {queued} overdue reminders ({outbox.stats.duplicates} already sent today)")
+        elif args.command == "send":
+            worker = OutboxWorker(outbox, sender_from_arguments(args), args.batch_size)
+            if args.follow:
+                worker.start()
+                try:
+                    while worker.thread.is_alive():
+                        worker.thread.join(1.0)
+                except KeyboardInterrupt:
+                    worker.stop()
+            else:
+                worker.drain()
+                worker.sender.close()
+            print(outbox.stats)
+            print(f"{len(outbox.pending)} notifications pending")
+        else:
+            for notification in outbox.pending.values():
+                print(notification)
+            print(f"{len(outbox.pending)} notifications pending")
+    finally:
+        outbox.close()
+
+
+if __name__ == "__main__":
+    main()
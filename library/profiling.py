@@ -0,0 +1,285 @@
+"""
+Opt-in profiling of sessions of the Library Management System.
+
+The profiler is installed on the menu class at start-up (python main.py --profile DIR) and only then: when profiling
+is off no wrapper is installed, so nothing is paid for it. Once installed it replaces the menus, the input prompts and
+the instrumented LibraryManagementSystem operations of the class with wrappers recording:
+    - menu actions: an action starts when a menu choice is entered and ends at the next menu prompt. The time spent
+      waiting for the user at other prompts (IDs, names) is left out. Menus reading their choice as text (the
+      library menu, where a library ID can be entered) start an action at their first text prompt.
+    - operations called outside of any action (scripts using the system without the menus) are profiled one by one.
+
+Each action or operation is profiled with cProfile while tracemalloc traces the allocations. It gets a numbered
+pstats file (e.g. 0003-books_menu-2.prof, for pstats or snakeviz) and a text report with its time, its peak
+allocation, the operations it called and the functions and lines which took the most time and memory. summary.txt
+lists them all, one line each.
+
+Scripts can profile their calls the same way:
+    profiler = Profiler("profiles").install(LibraryManagementSystem)
+    ...
+    profiler.uninstall()
+"""
+
+import cProfile
+import functools
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+
+# Menu methods of LibraryMenuIterface which are not named *_menu
+MENU_METHODS = {"user_login", "member_login"}
+# Menus whose choice is read with validate_string_input instead of validate_number_input
+TEXT_CHOICE_MENUS = {"library_menu"}
+
+UNSAFE_FILENAME_CHARACTERS = re.compile(r"[^\w.-]")
+
+# Leaves the allocations of the profiler itself out of the reports.
+PROFILER_FILTERS = [tracemalloc.Filter(False, module.__file__) for module in [tracemalloc, cProfile, pstats]] + [
+    tracemalloc.Filter(False, __file__)
+]
+
+
+def format_size(size):
+    if abs(size) < 1024:
+        return f"{size} B"
+    for unit in ["KiB", "MiB"]:
+        size /= 1024
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+    return f"{size / 1024:.1f} GiB"
+
+
+class Record:
+    """
+    A profiled action or operation.
+    """
+
+    def __init__(self, number, name):
+        self.number = number
+        self.name = name
+        self.profile = cProfile.Profile()
+        self.seconds = 0.0
+        # Traced memory when the record started, and the highest traced memory since
+        tracemalloc.reset_peak()
+        self.start_memory = tracemalloc.get_traced_memory()[0]
+        self.peak_memory = self.start_memory
+        # (Operation, seconds, peak allocation) of the operations called during an action
+        self.calls = []
+        self.resumed = None
+
+    def resume(self):
+        self.resumed = time.perf_counter()
+        self.profile.enable()
+
+    def pause(self):
+        self.profile.disable()
+        self.seconds += time.perf_counter() - self.resumed
+        self.observe_peak()
+
+    def observe_peak(self):
+        self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+
+    @property
+    def peak_allocation(self):
+        return self.peak_memory - self.start_memory
+
+    @property
+    def filename(self):
+        # Names of library menu actions include the library ID entered, which may hold any character.
+        return f"{self.number:04d}-{UNSAFE_FILENAME_CHARACTERS.sub('_', self.name)}"
+
+
+class Profiler:
+    """
+    Profiles the actions of a session into a directory. top is the number of functions and allocation sites listed
+    in each report.
+    """
+
+    def __init__(self, directory, top=20):
+        self.directory = directory
+        self.top = top
+        # (Class, attribute, original value) of the replaced methods
+        self.originals = []
+        self.count = 0
+        # The record of the current action or outermost operation
+        self.current = None
+        # Name of the last menu entered
+        self.menu = None
+        # Whether the next text prompt is the choice of a menu in TEXT_CHOICE_MENUS
+        self.choosing = False
+        # Depth of nested operation calls
+        self.depth = 0
+        self.snapshot = None
+        # Only the thread running the session is profiled; background threads (e.g. the outbox worker) call through.
+        self.thread = None
+
+    def install(self, cls):
+        """
+        Replaces the menus, prompts and operations of cls (and of the classes it inherits from) with profiled ones.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.thread = threading.get_ident()
+        tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+        for klass in cls.__mro__:
+            for attribute, value in list(vars(klass).items()):
+                if getattr(value, "operation", None) is not None:
+                    wrapper = self.wrap_operation(value, value.operation)
+                elif attribute == "validate_number_input":
+                    wrapper = self.wrap_menu_prompt(value)
+                elif attribute == "validate_string_input":
+                    wrapper = self.wrap_prompt(value)
+                elif attribute.endswith("_menu") or attribute in MENU_METHODS:
+                    wrapper = self.wrap_menu(value)
+                else:
+                    continue
+                self.originals.append((klass, attribute, value))
+                setattr(klass, attribute, wrapper)
+        return self
+
+    def uninstall(self):
+        """
+        Writes the current action and restores the original methods.
+        """
+        self.end_action()
+        for klass, attribute, value in reversed(self.originals):
+            setattr(klass, attribute, value)
+        self.originals = []
+        tracemalloc.stop()
+
+    def profiling(self):
+        return threading.get_ident() == self.thread
+
+    def start(self, name):
+        self.count += 1
+        self.current = Record(self.count, name)
+        self.current.resume()
+
+    def finish(self):
+        # Writes the report of the current record, which is paused.
+        record, self.current = self.current, None
+        path = os.path.join(self.directory, record.filename)
+        record.profile.dump_stats(path + ".prof")
+
+        lines = [
+            f"{record.name}",
+            f"Time: {record.seconds:.6f}s (without waiting for input)",
+            f"Peak allocation: {format_size(record.peak_allocation)}",
+        ]
+        if record.calls:
+            lines.append("")
+            lines.append("Operations:")
+            for operation, seconds, peak in record.calls:
+                lines.append(f"  {operation:<28}{seconds:>12.6f}s  peak {format_size(peak)}")
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(PROFILER_FILTERS)
+        growth = [statistic for statistic in snapshot.compare_to(self.snapshot, "lineno") if statistic.size_diff > 0]
+        lines.append("")
+        lines.append("Memory allocated since the previous report and still held, by line:")
+        for statistic in growth[: self.top]:
+            lines.append(f"  {statistic}")
+        self.snapshot = snapshot
+
+        stream = io.StringIO()
+        pstats.Stats(record.profile, stream=stream).sort_stats("cumulative").print_stats(self.top)
+        lines.append("")
+        lines.append(stream.getvalue().strip())
+        with open(path + ".txt", "w") as file:
+            file.write("\n".join(lines) + "\n")
+
+        with open(os.path.join(self.directory, "summary.txt"), "a") as file:
+            file.write(
+                f"{record.filename:<48}{record.seconds:>12.6f}s  peak {format_size(record.peak_allocation):>12}  "
+                f"{len(record.calls)} operation calls\n"
+            )
+
+    def wrap_menu(self, method):
+        @functools.wraps(method)
+        def wrapper(menu, *args, **kwargs):
+            if self.profiling():
+                self.menu = method.__name__
+                self.choosing = self.menu in TEXT_CHOICE_MENUS
+            return method(menu, *args, **kwargs)
+
+        return wrapper
+
+    def end_action(self):
+        # Writes the current action, if any.
+        if self.current is not None:
+            self.current.pause()
+            self.finish()
+
+    def wrap_menu_prompt(self, method):
+        # A menu choice ends the current action and starts the next one.
+        @functools.wraps(method)
+        def wrapper(menu, *args, **kwargs):
+            if not self.profiling():
+                return method(menu, *args, **kwargs)
+            self.end_action()
+            result = method(menu, *args, **kwargs)
+            self.start(f"{self.menu}-{menu.user_choice}")
+            return result
+
+        return wrapper
+
+    def wrap_prompt(self, method):
+        # Other prompts are part of the current action, without the time spent waiting for the answer.
+        @functools.wraps(method)
+        def wrapper(menu, *args, **kwargs):
+            if not self.profiling():
+                return method(menu, *args, **kwargs)
+            if self.choosing:
+                # The choice of a menu in TEXT_CHOICE_MENUS, which starts an action like a menu prompt.
+                self.choosing = False
+                self.end_action()
+                choice = method(menu, *args, **kwargs)
+                self.start(f"{self.menu}-{choice}")
+                return choice
+            if self.current is None:
+                return method(menu, *args, **kwargs)
+            self.current.pause()
+            try:
+                return method(menu, *args, **kwargs)
+            finally:
+                self.current.resume()
+
+        return wrapper
+
+    def wrap_operation(self, method, operation):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if not self.profiling() or self.depth:
+                # Nested operations are part of the operation calling them.
+                return method(*args, **kwargs)
+
+            self.depth += 1
+            try:
+                if self.current is None:
+                    # Called outside of any action: the operation is profiled on its own.
+                    self.start(operation)
+                    try:
+                        return method(*args, **kwargs)
+                    finally:
+                        self.current.pause()
+                        self.finish()
+
+                # Called by an action: its time and peak allocation are listed in the report of the action.
+                record = self.current
+                record.observe_peak()
+                memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                start = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    record.peak_memory = max(record.peak_memory, peak)
+                    record.calls.append((operation, time.perf_counter() - start, peak - memory))
+            finally:
+                self.depth -= 1
+
+        return wrapper
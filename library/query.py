@@ -0,0 +1,234 @@
+"""
+Composable queries over the collections of the Library Management System.
+
+A query is built by chaining where, between, order_by and limit, each of which returns a new query:
+    system.catalogue.where(library_id="1", item_type="Book").order_by("name").limit(10)
+    system.ledger.where(member_id="12", return_date=None)
+    system.ledger.between("borrow_date", start, end)
+
+Nothing is evaluated until the query is iterated. The planner then picks an index of the collection: first an
+equality index covering the most conditions, otherwise a range index over one of the ranges, otherwise a scan of the
+whole collection. The records it produces are streamed through generators applying the remaining conditions, the
+ordering and the limit. explain() describes the plan the query would take.
+"""
+
+import heapq
+import itertools
+
+
+class Index:
+    """
+    Answers equality conditions on its fields. lookup receives the values of the fields (in order) and returns the
+    matching records.
+    """
+
+    def __init__(self, name, fields, lookup):
+        self.name = name
+        self.fields = fields
+        self.lookup = lookup
+
+
+class RangeIndex:
+    """
+    Answers an inclusive range over one field. lookup receives the start and end (either may be None) and returns (or
+    yields) the matching records ordered by the field.
+    """
+
+    def __init__(self, name, field, lookup):
+        self.name = name
+        self.field = field
+        self.lookup = lookup
+
+
+class Source:
+    """
+    A queryable collection: its records, how to read a field of a record, and its indexes.
+    """
+
+    def __init__(self, name, records, get, indexes=(), range_indexes=()):
+        self.name = name
+        self.records = records
+        self.get = get
+        self.indexes = indexes
+        self.range_indexes = range_indexes
+
+
+def unique_lookup(mapping):
+    # Lookup of an index mapping each key to one record.
+    return lambda key: [mapping[key]] if key in mapping else []
+
+
+def group_lookup(mapping):
+    # Lookup of an index mapping each key to a dictionary of records.
+    return lambda key: mapping.get(key, {}).values()
+
+
+def get_attribute(record, field):
+    return getattr(record, field)
+
+
+def get_key(record, field):
+    return record[field]
+
+
+class Plan:
+    """
+    How a query is evaluated: the index used (None for a scan), the conditions and ranges it answers, and the
+    conditions and ranges left to filter on.
+    """
+
+    def __init__(self, index, values, conditions, ranges):
+        self.index = index
+        self.values = values
+        self.conditions = conditions
+        self.ranges = ranges
+
+    @property
+    def ordered_by(self):
+        # Range indexes produce their records ordered by their field.
+        return self.index.field if isinstance(self.index, RangeIndex) else None
+
+
+class Query:
+    """
+    An immutable query over a Source.
+    """
+
+    def __init__(self, source, conditions=None, ranges=None, order=None, count=None):
+        self.source = source
+        # Field -> value the field should equal
+        self.conditions = conditions or {}
+        # Field -> (start, end), inclusive; either bound may be None
+        self.ranges = ranges or {}
+        # (Field, reverse) or None
+        self.order = order
+        self.count = count
+
+    def copy(self, **changes):
+        values = {
+            "conditions": self.conditions,
+            "ranges": self.ranges,
+            "order": self.order,
+            "count": self.count,
+        }
+        values.update(changes)
+        return Query(self.source, **values)
+
+    def where(self, **conditions):
+        return self.copy(conditions={**self.conditions, **conditions})
+
+    def between(self, field, start=None, end=None):
+        return self.copy(ranges={**self.ranges, field: (start, end)})
+
+    def order_by(self, field, reverse=False):
+        return self.copy(order=(field, reverse))
+
+    def limit(self, count):
+        return self.copy(count=count)
+
+    def plan(self):
+        """
+        Chooses how to evaluate the query.
+        """
+        best = None
+        for index in self.source.indexes:
+            if all(field in self.conditions for field in index.fields):
+                if best is None or len(index.fields) > len(best.fields):
+                    best = index
+        if best is not None:
+            conditions = {field: value for field, value in self.conditions.items() if field not in best.fields}
+            values = [self.conditions[field] for field in best.fields]
+            return Plan(best, values, conditions, self.ranges)
+
+        for index in self.source.range_indexes:
+            if index.field in self.ranges:
+                ranges = {field: bounds for field, bounds in self.ranges.items() if field != index.field}
+                return Plan(index, list(self.ranges[index.field]), self.conditions, ranges)
+
+        return Plan(None, None, self.conditions, self.ranges)
+
+    def __iter__(self):
+        plan = self.plan()
+        get = self.source.get
+        if plan.index is None:
+            records = iter(self.source.records)
+        else:
+            records = iter(plan.index.lookup(*plan.values))
+
+        for field, value in plan.conditions.items():
+            records = filter_equal(records, get, field, value)
+        for field, (start, end) in plan.ranges.items():
+            records = filter_range(records, get, field, start, end)
+
+        if self.order is not None:
+            field, reverse = self.order
+            if plan.ordered_by != field:
+
+                def key(record):
+                    # Missing values (None) are ordered last in both directions, so their flag flips when reversed.
+                    value = get(record, field)
+                    return (value is None) != reverse, value
+
+                if self.count is not None:
+                    # Only the first `count` records are kept while sorting.
+                    select = heapq.nlargest if reverse else heapq.nsmallest
+                    return iter(select(self.count, records, key=key))
+                records = iter(sorted(records, key=key, reverse=reverse))
+            elif reverse:
+                records = reversed(list(records))
+
+        if self.count is not None:
+            records = itertools.islice(records, self.count)
+        return records
+
+    def all(self):
+        return list(self)
+
+    def first(self):
+        return next(iter(self.limit(1)), None)
+
+    def explain(self):
+        """
+        Describes the plan of the query, one step per line.
+        """
+        plan = self.plan()
+        if plan.index is None:
+            steps = [f"scan {self.source.name}"]
+        elif isinstance(plan.index, RangeIndex):
+            start, end = plan.values
+            steps = [f"range {plan.index.name} ({plan.index.field} from {start} to {end})"]
+        else:
+            covered = ", ".join(f"{field}={value!r}" for field, value in zip(plan.index.fields, plan.values))
+            steps = [f"index {plan.index.name} ({covered})"]
+
+        for field, value in plan.conditions.items():
+            steps.append(f"filter {field}={value!r}")
+        for field, (start, end) in plan.ranges.items():
+            steps.append(f"filter {field} from {start} to {end}")
+        if self.order is not None:
+            field, reverse = self.order
+            direction = " descending" if reverse else ""
+            if plan.ordered_by == field:
+                steps.append(f"order by {field}{direction} (from the index)")
+            elif self.count is not None:
+                # The limit is applied while sorting.
+                steps.append(f"top {self.count} by {field}{direction}")
+                return "\n".join(steps)
+            else:
+                steps.append(f"sort by {field}{direction}")
+        if self.count is not None:
+            steps.append(f"limit {self.count}")
+        return "\n".join(steps)
+
+
+def filter_equal(records, get, field, value):
+    for record in records:
+        if get(record, field) == value:
+            yield record
+
+
+def filter_range(records, get, field, start, end):
+    for record in records:
+        value = get(record, field)
+        if value is not None and (start is None or value >= start) and (end is None or value <= end):
+            yield record
@@ -0,0 +1,51 @@
+"""
+Memoized rendering of the listings shown by the menus.
+
+A listing (e.g. the books of a library) is rendered once into a single string and kept together with the generation
+of the data it was rendered from. Showing the listing again while the generation is unchanged writes the cached
+string as it is; once the generation has moved on the listing is rendered again and replaces the old entry.
+"""
+
+import sys
+
+
+class RenderCache:
+    """
+    Rendered listings keyed by name, each tagged with the generation it was rendered at.
+    """
+
+    def __init__(self):
+        # Key -> (generation, text)
+        self.entries = {}
+
+    def get(self, key, generation, render):
+        """
+        Returns the cached text of the key if it was rendered at this generation, otherwise calls render() and caches
+        its result.
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+        text = render()
+        self.entries[key] = (generation, text)
+        return text
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries = {}
+
+
+def render_lines(records, empty_message):
+    """
+    Renders one record per line, or the message if there are no records.
+    """
+    if not records:
+        return empty_message + "\n"
+    return "\n".join([str(record) for record in records]) + "\n"
+
+
+def write(text):
+    # A whole listing is written at once.
+    sys.stdout.write(text)
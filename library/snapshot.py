@@ -0,0 +1,82 @@
+"""
+Point-in-time snapshots of the collections of the Library Management System.
+
+Taking a snapshot copies nothing: the snapshot keeps references to the current lists of libraries, items, members
+and borrowings. Writers never change a list shared with a live snapshot in place; the first write after the snapshot
+copies the list (copy-on-write) and changes the copy. Records are never changed in place either: editing a library,
+item or member or returning a borrowing puts a changed copy in its place, so the records a reader got from a snapshot
+keep the values they had when it was taken. Writes hold the system's writer lock, so a snapshot never sees part of a
+change.
+
+A reader can therefore scan a snapshot for as long as it needs while other threads keep borrowing and returning.
+
+    with system.snapshot() as snapshot:
+        open_loans = sum(1 for borrowing in snapshot.borrowings if borrowing["return_date"] is None)
+"""
+
+from library.query import Query, Source, get_attribute, get_key
+
+SNAPSHOT_COLLECTIONS = ["libraries", "items", "members", "borrowings"]
+
+
+class SnapshotView:
+    """
+    The records of one collection of a snapshot. It can be iterated any number of times.
+    """
+
+    def __init__(self, snapshot, collection):
+        self.snapshot = snapshot
+        self.collection = collection
+
+    def __iter__(self):
+        return iter(self.snapshot.lists[self.collection])
+
+    def __len__(self):
+        return len(self.snapshot.lists[self.collection])
+
+
+class Snapshot:
+    """
+    A read-only view of the collections at the time it was taken. Release it (or use it as a context manager) once
+    done so that writers stop copying for it; a snapshot which is no longer referenced is released automatically.
+    """
+
+    def __init__(self, lists, owners):
+        # Collection -> the list of records at the time of the snapshot. These lists are never changed.
+        self.lists = lists
+        # The set of live snapshots of the system
+        self.owners = owners
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.release()
+
+    def release(self):
+        self.owners.discard(self)
+
+    @property
+    def libraries(self):
+        return SnapshotView(self, "libraries")
+
+    @property
+    def items(self):
+        return SnapshotView(self, "items")
+
+    @property
+    def members(self):
+        return SnapshotView(self, "members")
+
+    @property
+    def borrowings(self):
+        return SnapshotView(self, "borrowings")
+
+    @property
+    def catalogue(self):
+        # Queries over the items of the snapshot. Snapshots have no indexes, so they are scans.
+        return Query(Source("items", self.items, get_attribute))
+
+    @property
+    def ledger(self):
+        return Query(Source("borrowings", self.borrowings, get_key))
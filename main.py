@@ -1,4 +1,48 @@
+import argparse
+import atexit
+import os
+
+from library.events import EventBus, FileEventFeed
 from library.library import LibraryMenuIterface
+from library.metrics import metrics
+from library.outbox import HoldNotifier, Outbox, OutboxWorker, add_smtp_arguments, sender_from_arguments
+from library.profiling import Profiler
+
+parser = argparse.ArgumentParser(description="Library Management System")
+parser.add_argument("--metrics", action="store_true", help="Collect operation metrics during the session")
+parser.add_argument(
+    "--metrics-file", help="Write the metrics to this file on exit (.prom for the Prometheus format). Implies --metrics"
+)
+parser.add_argument("--events-file", help="Append the change events of the session to this JSON Lines file")
+parser.add_argument("--notify", action="store_true", help="Email members when items they hold are ready to borrow")
+parser.add_argument(
+    "--profile",
+    metavar="DIR",
+    help="Write a CPU profile and an allocation report of each menu action to this directory",
+)
+add_smtp_arguments(parser)
+args = parser.parse_args()
+
+if args.metrics or args.metrics_file:
+    metrics.enable()
+if args.metrics_file:
+    metrics.dump_on_exit(args.metrics_file)
+
+events = EventBus()
+if args.events_file:
+    FileEventFeed(args.events_file).attach(events)
+
+if args.notify:
+    # Notifications are queued in the outbox and sent in the background; unsent ones are kept for the next session.
+    outbox = Outbox(os.path.join("data", "outbox.jsonl"))
+    events.subscribe(HoldNotifier("data", outbox))
+    worker = OutboxWorker(outbox, sender_from_arguments(args)).start()
+    atexit.register(worker.stop, 5.0)
+
+if args.profile:
+    # The profiler wraps the menus and operations only when enabled; without --profile they are left untouched.
+    profiler = Profiler(args.profile).install(LibraryMenuIterface)
+    atexit.register(profiler.uninstall)
 
 print(
     """
@@ -15,4 +59,4 @@ print(
 )
 
 
-LibraryMenuIterface()
+LibraryMenuIterface(events=events)
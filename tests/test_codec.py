@@ -0,0 +1,76 @@
+import io
+
+import pytest
+
+from library.codec import (
+    CodecError,
+    decode_legacy_record,
+    decode_lines,
+    decode_record,
+    encode_record,
+    encode_records,
+    read_records,
+    write_header,
+)
+
+RECORDS = [
+    ["1", "Plain", None, ""],
+    ["2", "Smith, John", "a\\b", "#1"],
+    ["3", "two\nlines", "carriage\rreturn", "\\N"],
+    ["4", "ends with \\", ",", None],
+    [None, None, None, None],
+]
+
+
+def round_trip(records, batch_size):
+    file = io.StringIO()
+    write_header(file)
+    file.writelines(encode_records(records, batch_size))
+    file.seek(0)
+    return [list(fields) for fields in read_records(file, 4)]
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 1024])
+def test_records_round_trip(batch_size):
+    assert round_trip(RECORDS, batch_size) == RECORDS
+
+
+@pytest.mark.parametrize("batch_size", [1, 1024])
+def test_batches_without_escapes_round_trip(batch_size):
+    records = [[str(number), f"Item {number}", None if number % 3 else "Author", ""] for number in range(3000)]
+    assert round_trip(records, batch_size) == records
+
+
+def test_escaped_values_are_not_split():
+    line = encode_record(["1", "Smith, John", "#tag"])
+    assert line == "1,Smith\\, John,\\#tag\n"
+    assert decode_record(line, 3) == ["1", "Smith, John", "#tag"]
+
+
+def test_null_and_literal_null_are_distinct():
+    line = encode_record([None, "\\N"])
+    assert line == "\\N,\\\\N\n"
+    assert [list(fields) for fields in decode_lines([line])] == [[None, "\\N"]]
+
+
+def test_wrong_field_count_raises():
+    with pytest.raises(CodecError):
+        decode_record("1,2\n", 3)
+    with pytest.raises(CodecError):
+        list(decode_lines(["1,2\n", "3,4,5\n"], 2))
+
+
+def test_invalid_escape_raises():
+    with pytest.raises(CodecError):
+        decode_record("1,a\\x\n", 2)
+
+
+def test_legacy_files_are_read():
+    file = io.StringIO("1,Book,None,Someone\n2,Article,Journal,None\n")
+    assert list(read_records(file, 4)) == [["1", "Book", None, "Someone"], ["2", "Article", "Journal", None]]
+    assert decode_legacy_record("1,None\n") == ["1", None]
+
+
+def test_unsupported_format_version_raises():
+    with pytest.raises(CodecError):
+        list(read_records(io.StringIO("#LMS-FORMAT 99\n1,2\n")))
@@ -0,0 +1,60 @@
+import datetime
+import json
+
+from library.outbox import OVERDUE, Outbox
+
+
+def journal_entries(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_outboxes_of_several_processes_share_ids_and_keys(tmp_path):
+    path = str(tmp_path / "outbox.jsonl")
+    desk = Outbox(path)
+    cron = Outbox(path)
+    try:
+        first = desk.enqueue("1", "a@example.com", OVERDUE, "Overdue", "Body")
+        second = cron.enqueue("2", "b@example.com", OVERDUE, "Overdue", "Body")
+        assert cron.enqueue("1", "a@example.com", OVERDUE, "Overdue", "Body") is None
+        assert first.notification_id != second.notification_id
+
+        # The desk worker takes the reminder queued by the cron job, which no other worker takes again.
+        batch = desk.due(10)
+        assert [notification.notification_id for notification in batch] == [1, 2]
+        assert cron.due(10) == []
+        for notification in batch:
+            desk.mark_sent(notification)
+        assert cron.due(10) == [] and cron.next_due() is None
+    finally:
+        desk.close()
+        cron.close()
+
+    queued = [entry["notification"]["notification_id"] for entry in journal_entries(path) if entry["op"] == "queued"]
+    assert queued == [1, 2]
+
+
+def test_journal_is_not_compacted_while_open_elsewhere(tmp_path):
+    path = str(tmp_path / "outbox.jsonl")
+    yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+    desk = Outbox(path)
+    try:
+        notification = desk.enqueue("1", "a@example.com", OVERDUE, "Overdue", "Body")
+        desk.mark_sent(notification)
+        with open(path, "r") as file:
+            lines = file.read().replace(datetime.date.today().isoformat(), yesterday)
+        with open(path, "w") as file:
+            file.write(lines)
+
+        # The desk still appends to the journal, so a second outbox leaves it as it is.
+        cron = Outbox(path)
+        cron.close()
+        assert len(journal_entries(path)) == 2
+        assert desk.enqueue("2", "b@example.com", OVERDUE, "Overdue", "Body") is not None
+    finally:
+        desk.close()
+
+    # Once nobody else has it open, the sent notification of yesterday is dropped.
+    alone = Outbox(path)
+    alone.close()
+    assert [entry["notification"]["member_id"] for entry in journal_entries(path)] == ["2"]
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from library.benchmark import generate_system, loaded_system
+
+
+@pytest.fixture
+def system(tmp_path):
+    generate_system(2000, str(tmp_path))
+    return loaded_system(str(tmp_path))
+
+
+def test_held_open_loans_are_not_returned_by_later_writes(system):
+    with system.snapshot() as snapshot:
+        open_loans = snapshot.ledger.where(return_date=None).all()
+        assert open_loans
+        borrowing = open_loans[0]
+        assert system.return_items([borrowing["borrowing_id"]])
+
+        assert borrowing["return_date"] is None
+        assert all(loan["return_date"] is None for loan in open_loans)
+        assert len(snapshot.ledger.where(return_date=None).all()) == len(open_loans)
+
+    returned = system.ledger.where(borrowing_id=borrowing["borrowing_id"]).first()
+    assert returned["return_date"] is not None
+    assert returned is not borrowing
+
+
+def test_held_records_keep_their_values_across_edits(system):
+    with system.snapshot() as snapshot:
+        library = next(iter(snapshot.libraries))
+        item = next(iter(snapshot.items))
+        member = next(iter(snapshot.members))
+        library_name, item_name, email = library.name, item.name, member.email
+
+        assert system.edit_library(library.library_id, "Renamed")
+        assert system.edit_item(item.item_id, item.library_id, item.item_type, "Renamed", book_author="Someone")
+        assert system.edit_member(member.member_id, member.first_name, member.last_name, "renamed@example.com")
+
+        assert (library.name, item.name, member.email) == (library_name, item_name, email)
+        assert next(iter(snapshot.items)).name == item_name
+
+    assert system.item_index[item.item_id].name == "Renamed"
+    assert system.library_items[item.library_id][item.item_id] is system.item_index[item.item_id]
+    assert system.item_index[item.item_id] in system.items
+    assert item not in system.items
+
+
+def test_edited_item_moves_to_its_new_library(system):
+    item = system.items[0]
+    previous_library_id = item.library_id
+    library_id = next(library.library_id for library in system.libraries if library.library_id != previous_library_id)
+    assert system.edit_item(item.item_id, library_id, item.item_type, item.name, book_author=item.book_author)
+
+    assert item.item_id not in system.library_items.get(previous_library_id, {})
+    assert system.library_items[library_id][item.item_id].library_id == library_id
+
+
+def test_records_held_while_streaming_under_traffic_do_not_change(system):
+    member_id = system.members[0].member_id
+    stopping = threading.Event()
+    changes = []
+
+    def traffic():
+        # Borrows and returns items until the scan is over.
+        number = 0
+        while not stopping.is_set():
+            number += 1
+            system.borrow_item(str(number % len(system.items) + 1), member_id)
+            borrowing = system.ledger.where(member_id=member_id, return_date=None).first()
+            if borrowing is not None and system.return_item(borrowing["borrowing_id"]):
+                changes.append(borrowing["borrowing_id"])
+
+    with system.snapshot() as snapshot:
+        writer = threading.Thread(target=traffic)
+        writer.start()
+        try:
+            held = []
+            # Scans until the writer has returned 20 loans, failing instead of hanging if it dies or stalls.
+            deadline = time.monotonic() + 30
+            while len(changes) < 20 and writer.is_alive() and time.monotonic() < deadline:
+                held.extend((borrowing, borrowing["return_date"]) for borrowing in snapshot.borrowings)
+            assert writer.is_alive(), "The writer thread stopped"
+            assert len(changes) >= 20, "The writer returned too few loans in time"
+        finally:
+            stopping.set()
+            writer.join(30)
+
+        assert all(borrowing["return_date"] == return_date for borrowing, return_date in held)
+        assert len({borrowing["borrowing_id"] for borrowing, _ in held}) == len(snapshot.borrowings)
+
+    assert all(system.loans.borrowings[borrowing_id]["return_date"] is not None for borrowing_id in changes)